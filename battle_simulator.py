@@ -1,149 +1,479 @@
+from poke_env.data import GenData
 from poke_env.environment import Battle
 from poke_env.player.battle_order import BattleOrder
+from poke_env.environment.move import DynamaxMove, EmptyMove, Move
 from poke_env.environment.pokemon import Pokemon
-import pandas as pd
+from instrumentation import metrics
 
+import copyreg
+import hashlib
+import io
 import logging
-from typing import Dict, List, Optional, Union, Tuple
+import pickle
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Union, Tuple
+
+# Configured once for every simulator of the process
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.WARN)
+if not logger.handlers:
+    logger.addHandler(logging.StreamHandler())
+
+# One protocol message: the `|`-split line, leading empty field included, so it can be
+# handed to Battle.parse_message as is. The command at [1] is interned.
+Message = Tuple[str, ...]
+
+# Commands forwarded to Battle.parse_message
+PARSED_COMMANDS = frozenset([
+    "drag", "switch", "-damage", "move", "cant", "turn", "-heal", "-boost",
+    "-weather", "faint", "-unboost", "-ability", "-start", "-activate",
+    "-status", "rule", "-clearallboost", "-clearboost", "-clearnegativeboost",
+    "-clearpositiveboost", "-copyboost", "-curestatus", "-cureteam", "-end",
+    "-endability", "-enditem", "-fieldend", "-fieldstart", "-formechange",
+    "detailschange", "-invertboost", "-item", "-mega", "-mustrecharge",
+    "-prepare", "-primal", "-setboost", "-sethp", "-sideend", "-sidestart",
+    "-singleturn", "-singlemove", "-swapboost", "-transform", "-zpower",
+    "clearpoke", "gen", "tier", "inactive", "player", "poke", "raw",
+    "replace", "start", "swap", "message", "-message", "-immune",
+    "-swapsideconditions", "title", "-terastallize"
+])
+# Parsed, but left out of the scenario text
+NON_SCENARIO_COMMANDS = frozenset(["inactive", "raw"])
+# Messages that reveal a side's team: its pokemon, their moves and tera types
+TEAM_EVENT_COMMANDS = frozenset(["switch", "move", "-terastallize"])
+# Messages that are a side's decision for the turn
+ACTION_COMMANDS = frozenset(["switch", "move"])
+# Messages tokenize_log indexes by the pokemon they name
+INDEXED_COMMANDS = TEAM_EVENT_COMMANDS | frozenset(["faint"])
+# Messages that can change pokemon they don't name: the whole side of the named pokemon
+# (the one switched out loses its boosts, a team cure heals everyone), or anyone at all
+SIDE_CHANGING_COMMANDS = frozenset(["switch", "drag", "replace", "-cureteam"])
+BATTLE_CHANGING_COMMANDS = frozenset(["player", "-clearallboost", "swap", "-swapsideconditions"])
+
+
+class TokenizedLog(NamedTuple):
+    turn_logs: Dict[int, List[Message]]
+    winner: str
+    # side ("p1"/"p2") -> its switch, move and -terastallize messages, in log order
+    team_events: Dict[str, List[Message]]
+    # (turn, side) -> the side's first move or switch message of that turn
+    first_actions: Dict[Tuple[int, str], Message]
+    # (turn, side) pairs in which one of the side's pokemon fainted
+    faints: Set[Tuple[int, str]]
+
+
+def tokenize_log(log_content: str) -> TokenizedLog:
+    """Splits a showdown log into its messages, grouped by the turn they belong to, in one pass.
+
+    The same pass finds the winner and indexes the events the simulator looks up per side:
+    team reveals, each turn's first action and faints.
+    """
+    turn_logs: Dict[int, List[Message]] = {}
+    winner = ""
+    team_events: Dict[str, List[Message]] = {}
+    first_actions: Dict[Tuple[int, str], Message] = {}
+    faints: Set[Tuple[int, str]] = set()
+    current_turn = 0
+    messages: Optional[List[Message]] = None
+    intern = sys.intern
+    for line in log_content.split("\n"):
+        line = line.strip()
+        if not line.startswith("|"):
+            continue
+        tokens = line.split("|")
+        command = tokens[1] = intern(tokens[1])
+        if len(tokens) < 3 and command in INDEXED_COMMANDS:
+            # a truncated "|move", "|switch" or "|faint" line names no pokemon: skip it
+            # rather than fail the battle on it
+            continue
+        if command == "turn":
+            current_turn = int(tokens[2])
+            messages = None
+        elif command == "win":
+            winner = tokens[2]
+        if messages is None:
+            messages = turn_logs.setdefault(current_turn, [])
+        message = tuple(tokens)
+        messages.append(message)
+
+        if command in TEAM_EVENT_COMMANDS:
+            # "p1a: Garchomp" -> "p1"
+            side = tokens[2][:2]
+            team_events.setdefault(side, []).append(message)
+            if command in ACTION_COMMANDS:
+                first_actions.setdefault((current_turn, side), message)
+        elif command == "faint":
+            faints.add((current_turn, tokens[2][:2]))
+    return TokenizedLog(turn_logs, winner, team_events, first_actions, faints)
+
+
+# Simulator attributes that only depend on the log, or are shared between battles, and caches
+# derived from the state; snapshots leave them out
+SNAPSHOT_EXCLUDED_ATTRIBUTES = frozenset([
+    "logger", "_data", "log_content", "turn_logs", "_team_events", "_first_actions", "_faints",
+    "_snapshot_interval", "_snapshots",
+    "_change_counter", "_pokemon_changes", "_side_changes", "_battle_change", "team_data_cache",
+    "_scenario_cache",
+])
+
+
+def _team_key(token: str) -> Optional[str]:
+    # "p1a: Garchomp" or "[of] p1a: Garchomp" -> "p1: Garchomp", the key of the pokemon in
+    # its team (see Battle.get_pokemon); None for any other token
+    if token.startswith("[of] "):
+        token = token[5:]
+    if len(token) < 5 or token[0] != "p" or token[1] not in "1234":
+        return None
+    if token[2] == ":":
+        return token if token[3] == " " else None
+    if token[3:5] == ": ":
+        return token[:2] + token[3:]
+    return None
+
+
+def _rebuild_move(cls: type, attributes: Dict[str, Any]) -> Move:
+    move = cls.__new__(cls)
+    for name, value in attributes.items():
+        object.__setattr__(move, name, value)
+    if "_gen" in attributes:
+        object.__setattr__(move, "_moves_dict", GenData.from_gen(attributes["_gen"]).moves)
+    return move
+
+
+def _reduce_move(move: Move) -> Tuple[Any, ...]:
+    # every Move points at its gen's whole move table; store the gen only. EmptyMove answers 0
+    # for any missing attribute, so attributes are read without going through it.
+    attributes = {}
+    for name in Move.__slots__:
+        if name != "_moves_dict":
+            try:
+                attributes[name] = object.__getattribute__(move, name)
+            except AttributeError:
+                pass
+    if type(move) is not Move:
+        # the subclasses keep their own attributes in a __dict__
+        attributes.update(object.__getattribute__(move, "__dict__"))
+    return _rebuild_move, (type(move), attributes)
+
+
+# Snapshots are pickled: much faster than deepcopy, and already in the form they are saved in.
+# The gen data tables every battle shares are stored by gen rather than by value.
+_SNAPSHOT_DISPATCH_TABLE = copyreg.dispatch_table.copy()
+_SNAPSHOT_DISPATCH_TABLE[GenData] = lambda gen_data: (GenData.from_gen, (gen_data.gen,))
+_SNAPSHOT_DISPATCH_TABLE[Move] = _reduce_move
+_SNAPSHOT_DISPATCH_TABLE[EmptyMove] = _reduce_move
+_SNAPSHOT_DISPATCH_TABLE[DynamaxMove] = _reduce_move
+
+
+def _dump_state(state: Dict[str, Any]) -> bytes:
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.dispatch_table = _SNAPSHOT_DISPATCH_TABLE
+    pickler.dump(state)
+    return buffer.getvalue()
+
 
 class BattleSimulator(Battle):
-    def __init__(self, battle_tag: str, log_content: str):
+    def __init__(self, battle_tag: str, log_content: str, snapshot_interval: int = 0):
         # give it a logger
-        self.logger: logging.Logger = logging.getLogger(__name__)
-        self.logger.setLevel(logging.WARN)
-        self.logger.addHandler(logging.StreamHandler())
+        self.logger: logging.Logger = logger
 
         self.turn: int = 0
         self.p1: Optional[str] = None 
         self.p2: Optional[str] = None
         self.winner: str = ""
-        self.turn_logs: Dict[int, List[List[str]]] = {}
+        self.turn_logs: Dict[int, List[Message]] = {}
         self.log_content: str = log_content
-        self.parse_message_commands: List[str] = [
-            "drag", "switch", "-damage", "move", "cant", "turn", "-heal", "-boost",
-            "-weather", "faint", "-unboost", "-ability", "-start", "-activate",
-            "-status", "rule", "-clearallboost", "-clearboost", "-clearnegativeboost",
-            "-clearpositiveboost", "-copyboost", "-curestatus", "-cureteam", "-end",
-            "-endability", "-enditem", "-fieldend", "-fieldstart", "-formechange",
-            "detailschange", "-invertboost", "-item", "-mega", "-mustrecharge",
-            "-prepare", "-primal", "-setboost", "-sethp", "-sideend", "-sidestart",
-            "-singleturn", "-singlemove", "-swapboost", "-transform", "-zpower",
-            "clearpoke", "gen", "tier", "inactive", "player", "poke", "raw",
-            "replace", "start", "swap", "message", "-message", "-immune",
-            "-swapsideconditions", "title", "-terastallize"
-        ]
+        self._team_events: Dict[str, List[Message]] = {}
+        self._first_actions: Dict[Tuple[int, str], Message] = {}
+        self._faints: Set[Tuple[int, str]] = set()
         self.player_decision: Dict[int, Tuple[BattleOrder, bool]] = {}
+        # the scenario text of every simulated turn, appended by simulate_new_turn; get_scenario
+        # joins them on demand and keeps the whole text until the next turn
+        self._scenario_turns: List[str] = []
+        self._scenario_cache: Optional[str] = ""
+        # length of the whole scenario text, kept up to date without joining it
+        self._scenario_length: int = 0
+        # pickled state at the start of every `snapshot_interval`-th turn, keyed by turn (see seek)
+        self._snapshot_interval: int = snapshot_interval
+        self._snapshots: Dict[int, bytes] = {}
+        # when each pokemon (by team key), each side, or anything at all was last changed by a
+        # message, on one counter, so per-pokemon data derived from the state can be reused
+        # until its pokemon changes (see pokemon_version)
+        self._change_counter: int = 0
+        self._pokemon_changes: Dict[str, int] = {}
+        self._side_changes: Dict[str, int] = {}
+        self._battle_change: int = 0
+        # free for callers to keep per-pokemon data in, next to the pokemon_version it was built at
+        self.team_data_cache: Dict[Any, Any] = {}
         self._parse_log_find_winner()
         self.logger.info(f"Winner of this battle: {self.winner}")
         super().__init__(battle_tag=battle_tag, username=self.winner, gen=9, logger=self.logger)
 
+    def reset(self, battle_tag: str, log_content: str) -> None:
+        # Reuse this simulator for another battle, keeping its snapshot interval
+        self.__init__(battle_tag, log_content, snapshot_interval=self._snapshot_interval)
+
     def _parse_log_find_winner(self) -> None:
-        current_turn: int = 0
-
-        for line in self.log_content.split('\n'):
-            line = line.strip()
-            if line.startswith('|'):
-                split_message: List[str] = line.split('|')[1:]
-                if split_message[0] == 'turn':
-                    current_turn = int(split_message[1])
-                if current_turn not in self.turn_logs:
-                    self.turn_logs[current_turn] = []
-                if split_message[0] == "win":
-                    self.winner = split_message[1]
-                self.turn_logs[current_turn].append(split_message)
+        tokenized = tokenize_log(self.log_content)
+        self.turn_logs = tokenized.turn_logs
+        self.winner = tokenized.winner
+        self._team_events = tokenized.team_events
+        self._first_actions = tokenized.first_actions
+        self._faints = tokenized.faints
     
     def _register_player_pokemons(self) -> None:
         self.logger.info("Registering player pokemons")
-        for _, messages in self.turn_logs.items():
-            for split_message in messages:
-                if split_message[0] == "switch" and split_message[1].startswith(self._player_role):
-                    team_key = split_message[1].replace(self._player_role+"a", self._player_role)
-                    if team_key not in self._team.keys():  
-                        pokemon = self.get_pokemon(split_message[1], details=split_message[2], force_self_team=True)
-                        hp = int(split_message[3].split("/")[0])
-                        pokemon._current_hp = hp
-                        pokemon._max_hp = hp
-                        self.logger.info(f"Registered pokemon {pokemon}")
-                elif split_message[0] == "move" and split_message[1].startswith(self._player_role):
-                    pokemon, move = split_message[1:3]
-                    self.get_pokemon(pokemon)._add_move(move)
-                    self.logger.info(f"Added move {move} to {pokemon}")
-                elif split_message[0] == "-terastallize" and split_message[1].startswith(self._player_role):
-                    pokemon, terra_type = split_message[1:3]
-                    self.get_pokemon(pokemon)._terastallized_type = terra_type
-                    self.logger.info(f"Added terra type {terra_type} to {pokemon}")
+        for split_message in self._team_events.get(self._player_role, []):
+            if split_message[1] == "switch":
+                team_key = split_message[2].replace(self._player_role+"a", self._player_role)
+                if team_key not in self._team.keys():  
+                    pokemon = self.get_pokemon(split_message[2], details=split_message[3], force_self_team=True)
+                    hp = int(split_message[4].split("/")[0])
+                    pokemon._current_hp = hp
+                    pokemon._max_hp = hp
+                    self.logger.info(f"Registered pokemon {pokemon}")
+            elif split_message[1] == "move":
+                pokemon, move = split_message[2:4]
+                self.get_pokemon(pokemon)._add_move(move)
+                self.logger.info(f"Added move {move} to {pokemon}")
+            elif split_message[1] == "-terastallize":
+                pokemon, terra_type = split_message[2:4]
+                self.get_pokemon(pokemon)._terastallized_type = terra_type
+                self.logger.info(f"Added terra type {terra_type} to {pokemon}")
 
     def _parse_player_decision(self, current_turn: int) -> None:
         if current_turn >= len(self.turn_logs) - 1:
             return  # No decision to parse for the last turn
 
-        next_turn_messages = self.turn_logs[current_turn + 1]
-        fainted = False
-        for message in next_turn_messages:
-            if message[0] == "faint" and message[1].startswith(self._player_role):
-                fainted = True
-                break
-
-        for message in next_turn_messages:
-            if message[0] == "move" and message[1].startswith(self._player_role):
-                pokemon, move = message[1:3]
-                move = "".join(char for char in move if char.isalnum()).lower()
-                pokemon_obj = self.get_pokemon(pokemon)
-                move_obj = pokemon_obj.moves[move]
-                self.player_decision[current_turn] = (BattleOrder(move_obj), False)
-                return
-            elif message[0] == "switch" and message[1].startswith(self._player_role):
-                pokemon = message[1].replace(self._player_role+"a", self._player_role)
-                switch_pokemon = self.get_pokemon(pokemon)
-                self.player_decision[current_turn] = (BattleOrder(switch_pokemon), fainted)
-                return
+        # the decision is the player's first move or switch of the next turn
+        message = self._first_actions.get((current_turn + 1, self._player_role))
+        if message is None:
+            return
+        if message[1] == "move":
+            pokemon, move = message[2:4]
+            move = "".join(char for char in move if char.isalnum()).lower()
+            pokemon_obj = self.get_pokemon(pokemon)
+            move_obj = pokemon_obj.moves[move]
+            self.player_decision[current_turn] = (BattleOrder(move_obj), False)
+        else:
+            pokemon = message[2].replace(self._player_role+"a", self._player_role)
+            switch_pokemon = self.get_pokemon(pokemon)
+            fainted = (current_turn + 1, self._player_role) in self._faints
+            self.player_decision[current_turn] = (BattleOrder(switch_pokemon), fainted)
+
+    def planned_decisions(self) -> Dict[int, bool]:
+        # Turn -> whether it is a switch forced by a faint, for every turn _parse_player_decision
+        # will find a decision for. Read off the token index, before any turn is simulated.
+        role = self._player_role
+        if role is None:
+            for message in self.turn_logs.get(0, []):
+                if message[1] == "player" and len(message) > 3 and message[2] in ("p1", "p2") and message[3] == self.winner:
+                    role = message[2]
+        decisions: Dict[int, bool] = {}
+        for turn in range(len(self.turn_logs) - 1):
+            message = self._first_actions.get((turn + 1, role))
+            if message is not None:
+                decisions[turn] = message[1] != "move" and (turn + 1, role) in self._faints
+        return decisions
 
     def simulate_new_turn(self) -> bool:
         if self.turn >= len(self.turn_logs):
             self._finish_battle()
             return False
 
+        if self._snapshot_interval and self.turn % self._snapshot_interval == 0 and self.turn not in self._snapshots:
+            self._snapshots[self.turn] = self._capture_state()
+
+        start = time.perf_counter()
         self.logger.info(f"Processing turn {self.turn}")
-        messages: List[List[str]] = self.turn_logs[self.turn]
-
-        for split_message in messages:
-            if split_message[0] in self.parse_message_commands:
-                if split_message[0] == "player" and split_message[1] in ["p1", "p2"]:
-                    if split_message[1] == "p1":
-                        self.p1 = split_message[2]
-                        if split_message[2] == self.winner:
+        messages: List[Message] = self.turn_logs[self.turn]
+        scenario_lines: List[str] = []
+
+        message: Optional[Message] = None
+        try:
+            for message in messages:
+                command = message[1]
+                if command not in PARSED_COMMANDS:
+                    continue
+                if command == "player" and message[2] in ["p1", "p2"]:
+                    if message[2] == "p1":
+                        self.p1 = message[3]
+                        if message[3] == self.winner:
                             self._player_role = "p1"
                             self._register_player_pokemons()
-                    elif split_message[1] == "p2":
-                        self.p2 = split_message[2]
-                        if split_message[2] == self.winner:
+                    elif message[2] == "p2":
+                        self.p2 = message[3]
+                        if message[3] == self.winner:
                             self._player_role = "p2"
                             self._register_player_pokemons()
-                    if self.opponent_username is None and split_message[2] != self.winner:
-                        self.opponent_username = split_message[2]
+                    if self.opponent_username is None and message[3] != self.winner:
+                        self.opponent_username = message[3]
+                    self._mark_changed(message)
                     continue
-                elif split_message[0] == "switch":
-                    if split_message[1] == "p1a":
-                        split_message[1] = self.p1
-                    elif split_message[1] == "p2a":
-                        split_message[1] = self.p2
-                split_message.insert(0, "padding")
+                # parse_message may drop trailing fields, so it gets its own copy and the
+                # scenario line is built from what it left
+                split_message = list(message)
+                if command == "switch":
+                    if split_message[2] == "p1a":
+                        split_message[2] = self.p1
+                    elif split_message[2] == "p2a":
+                        split_message[2] = self.p2
                 self.parse_message(split_message)
+                self._mark_changed(message)
+                if command not in NON_SCENARIO_COMMANDS:
+                    scenario_lines.append(" ".join(split_message[1:]))
+        except Exception as e:
+            # lets callers tell which protocol message the battle failed on
+            e.battle_message = message
+            raise
 
+        self._extend_scenario(scenario_lines)
         self._parse_player_decision(self.turn)
         self.turn += 1
+        metrics.add_time("simulate_turn", time.perf_counter() - start)
+        metrics.incr("turns")
         return True
     
-    def get_scenario(self) -> str:
-        # Return only the parsed logs up to the current turn
-        parsed_logs = []
-        self.logger.info(f"Parsing logs up to turn {self.turn}")
-        for turn in range(self.turn):
-            # only extend the parsed logs if the log is supported by parse_message_commands
-            for split_message in self.turn_logs[turn]:
-                if split_message[0] == "padding" and split_message[1] != "inactive" and split_message[1] != "raw":
-                    parsed_logs.append(split_message[1:])
-        return "\n".join([" ".join(message) for message in parsed_logs])
+    def _mark_changed(self, message: Message) -> None:
+        self._change_counter += 1
+        command = message[1]
+        if command in BATTLE_CHANGING_COMMANDS:
+            self._battle_change = self._change_counter
+        elif command in SIDE_CHANGING_COMMANDS:
+            self._side_changes[message[2][:2]] = self._change_counter
+        for token in message[2:]:
+            key = _team_key(token)
+            if key is not None:
+                self._pokemon_changes[key] = self._change_counter
+
+    def pokemon_version(self, team_key: str) -> int:
+        # Changes whenever a message may have changed the pokemon at `team_key` ("p1: Garchomp")
+        return max(
+            self._pokemon_changes.get(team_key, 0),
+            self._side_changes.get(team_key[:2], 0),
+            self._battle_change,
+        )
+
+    def _extend_scenario(self, scenario_lines: List[str]) -> None:
+        # nothing is copied here, so turns nobody asks the scenario of cost nothing
+        text = "\n".join(scenario_lines)
+        self._scenario_turns.append(text)
+        self._scenario_cache = None
+        if text:
+            # turns are joined with a newline, and empty turns are left out
+            self._scenario_length += len(text) + 1 if self._scenario_length else len(text)
+
+    @property
+    def scenario_length(self) -> int:
+        # len(get_scenario()), without building the text
+        return self._scenario_length
+
+    def get_scenario(self, last_turns: Optional[int] = None) -> str:
+        # Return only the parsed logs up to the current turn, or only those of the last `last_turns` turns
+        if last_turns is None or last_turns >= len(self._scenario_turns):
+            if self._scenario_cache is None:
+                self._scenario_cache = "\n".join(turn for turn in self._scenario_turns if turn)
+            return self._scenario_cache
+        if last_turns <= 0:
+            return ""
+        return "\n".join(turn for turn in self._scenario_turns[-last_turns:] if turn)
+
+    def _capture_state(self) -> bytes:
+        state = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if name not in SNAPSHOT_EXCLUDED_ATTRIBUTES and hasattr(self, name):
+                    state[name] = getattr(self, name)
+        for name, value in self.__dict__.items():
+            if name not in SNAPSHOT_EXCLUDED_ATTRIBUTES:
+                state[name] = value
+        return _dump_state(state)
+
+    def _restore_state(self, snapshot: bytes) -> None:
+        for name, value in pickle.loads(snapshot).items():
+            setattr(self, name, value)
+        # every pokemon object was replaced, and the scenario may be another turn's
+        self._scenario_cache = None
+        self._change_counter += 1
+        self._battle_change = self._change_counter
+        self.team_data_cache.clear()
+
+    def seek(self, turn: int) -> None:
+        """Brings the simulator to the state it is in after `turn` calls to simulate_new_turn.
+
+        The latest snapshot at or before `turn` is restored and the remaining turns are
+        replayed, unless the simulator can get there by replaying forward from where it is.
+        Snapshots are taken as turns are simulated (every `snapshot_interval` turns) or
+        come from load_snapshots; without any, the simulator can only seek forward.
+        """
+        if not 0 <= turn <= len(self.turn_logs):
+            raise ValueError(f"Turn {turn} is not in 0..{len(self.turn_logs)}")
+        start = max((snapshot_turn for snapshot_turn in self._snapshots if snapshot_turn <= turn), default=None)
+        # restore only when going back, or when a snapshot is closer to `turn` than the current state
+        if self.turn > turn or (start is not None and start > self.turn):
+            if start is None:
+                raise ValueError(f"No snapshot to go back to turn {turn} from turn {self.turn}")
+            self._restore_state(self._snapshots[start])
+        while self.turn < turn:
+            self.simulate_new_turn()
+
+    def save_snapshots(self, path: str) -> None:
+        # Stored next to the log, e.g. by battle id; load_snapshots checks they belong to the same log
+        with open(path, "wb") as f:
+            pickle.dump({
+                "log_sha1": hashlib.sha1(self.log_content.encode()).hexdigest(),
+                "snapshot_interval": self._snapshot_interval,
+                "snapshots": self._snapshots,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def load_snapshots(self, path: str) -> None:
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+        if saved["log_sha1"] != hashlib.sha1(self.log_content.encode()).hexdigest():
+            raise ValueError(f"Snapshots in {path} were taken from a different battle log")
+        self._snapshot_interval = saved["snapshot_interval"]
+        self._snapshots.update(saved["snapshots"])
+
+    def state_hash(self, coarse: bool = False) -> str:
+        """A hash of what the battle looks like now, the same for any two battles (or turns)
+        in the same state: both teams as far as they are known, boosts, status, tera, field
+        and side conditions, and the player's available orders. Player names, the turn
+        number and how the battle got here are left out.
+
+        `coarse` keeps only each pokemon's species, HP in quarters, status and whether it is
+        active, plus the sign of the active pokemon's boosts, so near-identical states share
+        a hash too.
+        """
+        sides = []
+        for team in (self._team, self._opponent_team):
+            pokemons = []
+            for pokemon in team.values():
+                status = pokemon.status.name if pokemon.status is not None else ""
+                boosts = tuple(sorted((stat, boost) for stat, boost in pokemon.boosts.items() if boost))
+                if coarse:
+                    pokemons.append((
+                        pokemon.species, pokemon.active, round(pokemon.current_hp_fraction * 4), status,
+                        tuple((stat, boost > 0) for stat, boost in boosts) if pokemon.active else (),
+                    ))
+                else:
+                    tera_type = pokemon.tera_type.name if pokemon.terastallized and pokemon.tera_type is not None else ""
+                    pokemons.append((
+                        pokemon.species, pokemon.active, pokemon.current_hp, status, boosts,
+                        pokemon.item or "", pokemon.ability or "", tera_type, tuple(sorted(pokemon.moves)),
+                    ))
+            sides.append(tuple(sorted(pokemons)))
+        conditions = (
+            tuple(sorted(weather.name for weather in self.weather)),
+            tuple(sorted(field.name for field in self.fields)),
+            tuple(sorted((condition.name, layers) for condition, layers in self.side_conditions.items())),
+            tuple(sorted((condition.name, layers) for condition, layers in self.opponent_side_conditions.items())),
+        )
+        orders: Tuple[str, ...] = ()
+        if not coarse and self.active_pokemon is not None:
+            orders = tuple(str(order) for order in self.get_available_orders())
+        return hashlib.sha1(repr((sides, conditions, orders)).encode()).hexdigest()[:16]
 
     def get_available_orders(self) -> List[BattleOrder]:
         available_orders: List[BattleOrder] = [
@@ -159,11 +489,56 @@ class BattleSimulator(Battle):
                 available_orders.append(BattleOrder(pokemon))
         return available_orders
 
+class TurnRecord(NamedTuple):
+    battle_id: str
+    # turns simulated so far
+    turn: int
+    # the live simulator, in its state after `turn` turns; only valid until the next record.
+    # None if the battle failed before its simulator was built
+    simulator: Optional[BattleSimulator]
+    # the battle is over: simulate_new_turn returned False, or raised `error`
+    done: bool = False
+    error: Optional[Exception] = None
+
+
+def iter_battles(battles: Iterable[Tuple[str, str]], snapshot_interval: int = 0) -> Iterator[TurnRecord]:
+    """Simulates every (battle_id, log_content) pair, yielding a record after each turn.
+
+    One simulator is reset and reused for all battles. Every battle ends with a `done`
+    record; a battle that fails to simulate ends early with the exception in `error`
+    instead of stopping the iteration.
+    """
+    simulator: Optional[BattleSimulator] = None
+    for battle_id, log_content in battles:
+        try:
+            if simulator is None:
+                simulator = BattleSimulator(battle_id, log_content, snapshot_interval=snapshot_interval)
+            else:
+                simulator.reset(battle_id, log_content)
+            while simulator.simulate_new_turn():
+                yield TurnRecord(battle_id, simulator.turn, simulator)
+        except Exception as e:
+            metrics.incr("errors", type=type(e).__name__)
+            yield TurnRecord(battle_id, simulator.turn if simulator is not None else 0, simulator, done=True, error=e)
+            # a half-built simulator is not reused
+            simulator = None
+            continue
+        metrics.incr("battles")
+        yield TurnRecord(battle_id, simulator.turn, simulator, done=True)
+
+
 if __name__ == "__main__":
+    from replay_store import REPLAY_STORE_PATH, ReplayStore, is_replay_store
+
+    # Read one log, straight from the replay store when there is one
+    if is_replay_store(REPLAY_STORE_PATH):
+        with ReplayStore(REPLAY_STORE_PATH) as store:
+            log_content = store.get_row(100)['log_content']
+    else:
+        import pandas as pd
 
-    # Read one log from the parquet file
-    df = pd.read_parquet("data/battle_logs.parquet")
-    log_content = df.iloc[100]['log_content']  # Assuming 'log_content' is the column name containing the battle log
+        df = pd.read_parquet("data/battle_logs.parquet")
+        log_content = df.iloc[100]['log_content']  # Assuming 'log_content' is the column name containing the battle log
     battleSimulator: BattleSimulator = BattleSimulator("log_battle_1", log_content)
     while battleSimulator.simulate_new_turn():
         print(f"Player's pokemon: {battleSimulator.active_pokemon.species}")
@@ -0,0 +1,234 @@
+"""Throughput, p50/p99 latency and peak RSS of every stage of the prompt pipeline.
+
+Battles come from benchmarks.synthetic_logs (generated on the fly, so any corpus size runs
+in constant memory) or from a battle_logs parquet file or replay store. Each stage runs in
+its own interpreter, so the peak RSS it reports is its own, and only the stage's own calls
+are timed: a per-turn stage replays the battles untimed and times its call after every
+turn. `damage` sends every query to @smogon/calc, with a zero-capacity cache so repeated
+queries still cross the bridge, and needs Node and the calc package (it is reported as
+skipped without them); `native_damage` times the queries native_damage handles in-process.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_pipeline --battles 1000 --min-turns 20 --max-turns 60
+    python -m benchmarks.bench_pipeline --input data/replay_store --stages simulate,team_data
+"""
+from typing import Any, Dict, Iterator, List, Tuple
+import argparse
+import json
+import random
+import resource
+import subprocess
+import sys
+import time
+
+STAGES = ["tokenize", "simulate", "scenario", "team_data", "random_sets", "damage", "native_damage", "render"]
+
+
+class LatencySample:
+    # A uniform sample of at most `size` latencies (reservoir sampling), for percentiles over
+    # any number of calls in bounded memory
+    def __init__(self, size: int = 100000, seed: int = 0):
+        self.size = size
+        self.count = 0
+        self.total = 0.0
+        self._values: List[float] = []
+        self._rng = random.Random(seed)
+
+    def add(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        if len(self._values) < self.size:
+            self._values.append(seconds)
+        else:
+            slot = self._rng.randrange(self.count)
+            if slot < self.size:
+                self._values[slot] = seconds
+
+    def percentile(self, q: float) -> float:
+        if not self._values:
+            return 0.0
+        values = sorted(self._values)
+        return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+def iter_logs(args: argparse.Namespace) -> Iterator[Tuple[str, str]]:
+    if args.input:
+        from replay_store import iter_battle_logs
+
+        for i, row in enumerate(iter_battle_logs(args.input)):
+            if i == args.battles:
+                break
+            yield row["battle_id"], row["log_content"]
+    else:
+        from benchmarks.synthetic_logs import generate_corpus
+
+        for row in generate_corpus(args.battles, args.seed, args.min_turns, args.max_turns):
+            yield row["battle_id"], row["log_content"]
+
+
+def _random_set_index():
+    # the real randbats sets when they are cached locally, otherwise the synthetic ones
+    from random_sets import RandomSetIndex, load_random_sets, random_sets_version
+    from benchmarks.synthetic_logs import synthetic_random_sets
+
+    if random_sets_version() is not None:
+        return RandomSetIndex(load_random_sets())
+    return RandomSetIndex(synthetic_random_sets())
+
+
+def run_stage(stage: str, battles: Iterator[Tuple[str, str]]) -> Dict[str, Any]:
+    from battle_simulator import BattleSimulator, tokenize_log
+    from damage_engine import DamageCache, DamageEngine, _calc_attributes
+    from native_damage import calculate
+    from produce_question_prompts import find_potential_random_set, get_team_data
+    from prompt_templates import build_prompt_fields, render_prompt
+    from random_sets import RandomSetResolver
+
+    latencies = LatencySample()
+    battle_count = errors = 0
+    index = _random_set_index() if stage == "random_sets" else None
+    # no cache entries, so every damage query is timed through the bridge rather than as a lookup
+    engine = DamageEngine(DamageCache(max_entries=0), native=False) if stage == "damage" else None
+    perf_counter = time.perf_counter
+
+    for battle_id, log_content in battles:
+        battle_count += 1
+        if stage == "tokenize":
+            start = perf_counter()
+            tokenize_log(log_content)
+            latencies.add(perf_counter() - start)
+            continue
+
+        resolver = RandomSetResolver(index) if index is not None else None
+        try:
+            simulator = BattleSimulator(battle_id, log_content)
+            while True:
+                start = perf_counter()
+                if not simulator.simulate_new_turn():
+                    break
+                elapsed = perf_counter() - start
+                if stage == "simulate":
+                    latencies.add(elapsed)
+                elif stage == "scenario":
+                    start = perf_counter()
+                    simulator.get_scenario()
+                    latencies.add(perf_counter() - start)
+                elif stage == "team_data":
+                    start = perf_counter()
+                    get_team_data(simulator)
+                    get_team_data(simulator, opponent=True)
+                    latencies.add(perf_counter() - start)
+                elif stage == "random_sets":
+                    team = get_team_data(simulator, opponent=True)
+                    start = perf_counter()
+                    find_potential_random_set(team, resolver)
+                    latencies.add(perf_counter() - start)
+                elif stage == "damage":
+                    if simulator.active_pokemon is None or simulator.opponent_active_pokemon is None:
+                        continue
+                    player = get_team_data(simulator)[simulator.active_pokemon.species]
+                    opponent = get_team_data(simulator, opponent=True)[simulator.opponent_active_pokemon.species]
+                    queries = [(player, opponent, move, True) for move in simulator.active_pokemon.moves] + [
+                        (opponent, player, move, False) for move in simulator.opponent_active_pokemon.moves
+                    ]
+                    start = perf_counter()
+                    engine.calculate_batch(queries)
+                    latencies.add(perf_counter() - start)
+                elif stage == "native_damage":
+                    if simulator.active_pokemon is None or simulator.opponent_active_pokemon is None:
+                        continue
+                    player = get_team_data(simulator)[simulator.active_pokemon.species]
+                    opponent = get_team_data(simulator, opponent=True)[simulator.opponent_active_pokemon.species]
+                    calc_inputs = [
+                        [player["name"], _calc_attributes(player), opponent["name"], _calc_attributes(opponent), move]
+                        for move in simulator.active_pokemon.moves
+                    ] + [
+                        [opponent["name"], _calc_attributes(opponent), player["name"], _calc_attributes(player), move]
+                        for move in simulator.opponent_active_pokemon.moves
+                    ]
+                    start = perf_counter()
+                    for calc_input in calc_inputs:
+                        calculate(calc_input)
+                    latencies.add(perf_counter() - start)
+                elif stage == "render":
+                    decision = simulator.player_decision.get(simulator.turn - 1)
+                    if decision is None:
+                        continue
+                    impacts = [(move, ("10%", "20%")) for move in simulator.active_pokemon.moves]
+                    start = perf_counter()
+                    scenario = simulator.get_scenario()
+                    render_prompt(build_prompt_fields(
+                        simulator.scenario_length, decision, simulator.get_available_orders(),
+                        simulator.active_pokemon.species, simulator.opponent_active_pokemon.species, impacts, impacts,
+                    ), scenario)
+                    latencies.add(perf_counter() - start)
+        except Exception as e:
+            if stage == "damage" and engine is not None and engine._calculator is None:
+                return {"stage": stage, "skipped": f"{type(e).__name__}: {str(e)[:160]}"}
+            errors += 1
+
+    result = {
+        "stage": stage,
+        "battles": battle_count,
+        "errors": errors,
+        "calls": latencies.count,
+        "unit": "battle" if stage == "tokenize" else "turn",
+        "seconds": latencies.total,
+        "calls_per_second": latencies.count / latencies.total if latencies.total else 0.0,
+        "p50_us": latencies.percentile(50) * 1e6,
+        "p99_us": latencies.percentile(99) * 1e6,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+    if engine is not None:
+        result["cache_hits"] = engine.cache.hits
+        result["cache_misses"] = engine.cache.misses
+    return result
+
+
+def run_in_subprocess(stage: str, argv: List[str]) -> Dict[str, Any]:
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_pipeline", "--stage", stage] + argv,
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--battles", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-turns", type=int, default=15)
+    parser.add_argument("--max-turns", type=int, default=45)
+    parser.add_argument("--input", help="A battle_logs parquet file or replay store instead of synthetic battles")
+    parser.add_argument("--stages", default=",".join(STAGES))
+    parser.add_argument("--output", help="Also write the results as JSON")
+    # runs a single stage in this process and prints its result; used for the per-stage interpreters
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        print(json.dumps(run_stage(args.stage, iter_logs(args))))
+        sys.exit(0)
+
+    argv = ["--battles", str(args.battles), "--seed", str(args.seed),
+            "--min-turns", str(args.min_turns), "--max-turns", str(args.max_turns)]
+    if args.input:
+        argv += ["--input", args.input]
+    results = []
+    print(f"{'stage':>13} {'calls':>9} {'calls/s':>11} {'p50 us':>9} {'p99 us':>9} {'peak RSS MB':>12}")
+    for stage in args.stages.split(","):
+        result = run_in_subprocess(stage, argv)
+        results.append(result)
+        if "skipped" in result:
+            print(f"{stage:>13}  skipped: {result['skipped']}")
+            continue
+        print(
+            f"{stage:>13} {result['calls']:>9} {result['calls_per_second']:>11.1f} {result['p50_us']:>9.1f} "
+            f"{result['p99_us']:>9.1f} {result['peak_rss_mb']:>12.1f}"
+            + (f"  ({result['errors']} battles failed)" if result["errors"] else "")
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,70 @@
+"""Per-prompt render time of the compiled template against the original chained
+`str.replace` implementation, on the same inputs.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_prompt_render --scenario-turns 40
+"""
+from typing import Any, Dict
+import argparse
+import timeit
+
+from prompt_templates import QUESTION_PROMPT, STRATEGY_PROMPT, TYPE_EFFECTIVENESS_PROMPT, TEMPLATE_ID, render_prompt
+
+SCENARIO_TURN = """move p1a: Corviknight Brave Bird p2a: Gholdengo
+-damage p2a: Gholdengo 47/100
+-damage p1a: Corviknight 231/280 [from] Recoil
+move p2a: Gholdengo Make It Rain p1a: Corviknight
+-damage p1a: Corviknight 150/280
+-unboost p2a: Gholdengo spa 1"""
+
+
+def legacy_render(fields: Dict[str, Any], scenario: str) -> str:
+    # produce_question_prompt as it was before the compiled template: one full copy per placeholder
+    available_orders_prompt = ""
+    for i, choice in enumerate(fields["choices"]):
+        available_orders_prompt += f"{i}. {choice}\n"
+    result = QUESTION_PROMPT.replace("[STRATEGY PROMPT]", STRATEGY_PROMPT).replace("[SCENARIO]", scenario).replace("[TYPE EFFECTIVENESS CHART]", TYPE_EFFECTIVENESS_PROMPT).replace("[WINNER_POKEMON]", fields["winner_pokemon"]).replace("[LOSER_POKEMON]", fields["loser_pokemon"]).replace("[WINNER_CHOICES]", available_orders_prompt)
+    result = result.replace("[WINNER_MOVE]", fields["winner_move"])
+    player_moves_impact_prompt = ""
+    for move in fields["player_moves_impact"]:
+        player_moves_impact_prompt += f"{move['move']}: {move['min']} - {move['max']}\n"
+    result = result.replace("[PLAYER_MOVES_IMPACT]", player_moves_impact_prompt)
+    opponent_moves_impact_prompt = ""
+    for move in fields["opponent_moves_impact"]:
+        opponent_moves_impact_prompt += f"{move['move']}: {move['min']} - {move['max']}\n"
+    result = result.replace("[OPPONENT_MOVES_IMPACT]", opponent_moves_impact_prompt)
+    return result
+
+
+def make_inputs(scenario_turns: int):
+    scenario = "\n".join(f"turn {turn}\n{SCENARIO_TURN}" for turn in range(1, scenario_turns + 1))
+    moves = ["bravebird", "roost", "bodypress", "uturn"]
+    fields = {
+        "template_id": TEMPLATE_ID,
+        "scenario_length": len(scenario),
+        "winner_pokemon": "corviknight",
+        "loser_pokemon": "gholdengo",
+        "choices": [f"/choose move {move}" for move in moves]
+        + [f"/choose move {move} terastallize" for move in moves]
+        + ["/choose switch garchomp", "/choose switch clefable"],
+        "winner_move": "/choose move bravebird",
+        "player_moves_impact": [{"move": move, "min": "31%", "max": "37%"} for move in moves],
+        "opponent_moves_impact": [{"move": move, "min": "12%", "max": "15%"} for move in ["makeitrain", "shadowball", "nastyplot"]],
+    }
+    return fields, scenario
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario-turns", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    fields, scenario = make_inputs(args.scenario_turns)
+    assert legacy_render(fields, scenario) == render_prompt(fields, scenario)
+
+    print(f"prompt size: {len(render_prompt(fields, scenario))} chars")
+    for name, render in [("chained str.replace", legacy_render), ("compiled template", render_prompt)]:
+        seconds = min(timeit.repeat(lambda: render(fields, scenario), number=args.repeat, repeat=5))
+        print(f"{name:>20}: {seconds / args.repeat * 1e6:8.2f} us/prompt")
@@ -0,0 +1,66 @@
+"""Cold-start import time of each pipeline module, against a per-module budget.
+
+Every module is imported in a fresh interpreter (the way a spawned worker starts), and
+the time of a bare interpreter start is subtracted. A module also fails its check when
+it pulls in one of the heavy dependencies it is expected to load lazily.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_startup --repeat 5
+"""
+from typing import List, Tuple
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ["javascript", "pandas", "poke_env", "pyarrow", "requests", "tqdm"]
+
+# (module, budget in ms over a bare interpreter, heavy modules it is allowed to import)
+ENTRY_POINTS: List[Tuple[str, float, List[str]]] = [
+    ("lookup_tables", 50, []),
+    ("random_sets", 50, []),
+    ("replay_store", 50, []),
+    ("damage_engine", 50, []),
+    ("prompt_templates", 50, []),
+    ("produce_question_prompts", 100, []),
+    ("parquet_stream", 400, ["pyarrow"]),
+    ("battle_simulator", 1500, ["poke_env", "requests"]),
+]
+
+PROBE = "import sys, json; import {module}; print(json.dumps(sorted(m for m in {heavy} if m in sys.modules)))"
+
+
+def run_python(code: str) -> Tuple[float, str]:
+    # wall time in ms of a fresh interpreter running `code`, and its stdout
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return (time.perf_counter() - start) * 1000, output
+
+
+def time_import(module: str, repeat: int) -> Tuple[float, List[str]]:
+    # median import time in ms of `module`, and the heavy modules it loaded
+    runs = [run_python(PROBE.format(module=module, heavy=HEAVY_MODULES)) for _ in range(repeat)]
+    return statistics.median(elapsed for elapsed, _ in runs), json.loads(runs[-1][1].splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    baseline = statistics.median(run_python("pass")[0] for _ in range(args.repeat))
+    print(f"bare interpreter: {baseline:.1f} ms")
+
+    failures = 0
+    for module, budget, allowed in ENTRY_POINTS:
+        elapsed, loaded = time_import(module, args.repeat)
+        elapsed -= baseline
+        unexpected = [name for name in loaded if name not in allowed]
+        ok = elapsed <= budget and not unexpected
+        failures += not ok
+        extra = f"  loads {', '.join(unexpected)}" if unexpected else ""
+        print(f"{module:>26}: {elapsed:8.1f} ms (budget {budget:6.0f} ms) {'ok' if ok else 'OVER'}{extra}")
+    sys.exit(1 if failures else 0)
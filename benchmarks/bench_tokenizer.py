@@ -0,0 +1,95 @@
+"""Protocol messages tokenized (and dispatched) per second by battle_simulator.tokenize_log,
+against the original split/strip/split loop with its list scan and "padding" insert, over
+the logs of a parquet file.
+
+Run from the repository root:
+
+    python -m benchmarks.bench_tokenizer --input data/battle_logs.parquet --limit 1000
+"""
+from typing import Dict, List, Tuple
+import argparse
+import time
+
+from battle_simulator import NON_SCENARIO_COMMANDS, PARSED_COMMANDS, tokenize_log
+from parquet_stream import iter_parquet_rows
+
+LEGACY_COMMANDS = sorted(PARSED_COMMANDS)
+
+
+def legacy_tokenize(log_content: str) -> Tuple[Dict[int, List[List[str]]], str]:
+    # BattleSimulator._parse_log_find_winner as it was before tokenize_log
+    turn_logs: Dict[int, List[List[str]]] = {}
+    winner = ""
+    current_turn = 0
+    for line in log_content.split('\n'):
+        line = line.strip()
+        if line.startswith('|'):
+            split_message: List[str] = line.split('|')[1:]
+            if split_message[0] == 'turn':
+                current_turn = int(split_message[1])
+            if current_turn not in turn_logs:
+                turn_logs[current_turn] = []
+            if split_message[0] == "win":
+                winner = split_message[1]
+            turn_logs[current_turn].append(split_message)
+    return turn_logs, winner
+
+
+def legacy_dispatch(turn_logs: Dict[int, List[List[str]]]) -> int:
+    # the per-message work simulate_new_turn did before handing a message to parse_message
+    lines = 0
+    for messages in turn_logs.values():
+        for split_message in messages:
+            if split_message[0] in LEGACY_COMMANDS:
+                split_message.insert(0, "padding")
+                if split_message[1] != "inactive" and split_message[1] != "raw":
+                    lines += len(" ".join(split_message[1:])) > 0
+    return lines
+
+
+def dispatch(turn_logs) -> int:
+    lines = 0
+    for messages in turn_logs.values():
+        for message in messages:
+            command = message[1]
+            if command in PARSED_COMMANDS:
+                split_message = list(message)
+                if command not in NON_SCENARIO_COMMANDS:
+                    lines += len(" ".join(split_message[1:])) > 0
+    return lines
+
+
+def run(logs: List[str], tokenize, dispatch_messages) -> Tuple[float, float]:
+    # seconds spent tokenizing, and tokenizing plus dispatching, all logs
+    start = time.perf_counter()
+    tokenized = [tokenize(log)[0] for log in logs]
+    tokenize_seconds = time.perf_counter() - start
+    for turn_logs in tokenized:
+        dispatch_messages(turn_logs)
+    return tokenize_seconds, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--input", default="data/battle_logs.parquet")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    logs = []
+    for row in iter_parquet_rows(args.input, columns=["log_content"]):
+        logs.append(row["log_content"])
+        if len(logs) >= args.limit:
+            break
+    messages = sum(len(turn) for log in logs for turn in tokenize_log(log)[0].values())
+    print(f"{len(logs)} logs, {messages} messages")
+
+    for name, tokenize, dispatch_messages in [
+        ("legacy", legacy_tokenize, legacy_dispatch),
+        ("tokenize_log", tokenize_log, dispatch),
+    ]:
+        tokenize_seconds, total_seconds = min(run(logs, tokenize, dispatch_messages) for _ in range(args.repeat))
+        print(
+            f"{name:>12}: {messages / tokenize_seconds / 1e6:6.2f} M msg/s tokenized, "
+            f"{messages / total_seconds / 1e6:6.2f} M msg/s tokenized + dispatched"
+        )
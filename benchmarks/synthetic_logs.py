@@ -0,0 +1,243 @@
+"""Deterministic synthetic Showdown logs of gen 9 random battles, for offline benchmarks.
+
+Battle `i` of seed `s` is always the same log, whatever the size of the corpus it is part
+of. Logs have both sides' switches, moves, damage, boosts, status, terastallization,
+faints and the forced switches that follow, and end with a win once the loser has no
+pokemon left, around the requested number of turns.
+
+Run from the repository root:
+
+    python -m benchmarks.synthetic_logs --battles 10000 --output data/synthetic_battle_logs.parquet
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import argparse
+import random
+
+# species -> moves, all valid gen 9 names
+POKEMON: Dict[str, List[str]] = {
+    "Garchomp": ["Earthquake", "Dragon Claw", "Swords Dance", "Stone Edge"],
+    "Heatran": ["Magma Storm", "Earth Power", "Flash Cannon", "Stealth Rock"],
+    "Gholdengo": ["Make It Rain", "Shadow Ball", "Nasty Plot", "Recover"],
+    "Corviknight": ["Brave Bird", "Body Press", "Roost", "U-turn"],
+    "Dragonite": ["Extreme Speed", "Dragon Dance", "Earthquake", "Fire Punch"],
+    "Kingambit": ["Sucker Punch", "Kowtow Cleave", "Iron Head", "Swords Dance"],
+    "Great Tusk": ["Headlong Rush", "Close Combat", "Ice Spinner", "Rapid Spin"],
+    "Snorlax": ["Body Slam", "Curse", "Earthquake", "Rest"],
+    "Blissey": ["Seismic Toss", "Soft-Boiled", "Thunder Wave", "Calm Mind"],
+    "Clefable": ["Moonblast", "Flamethrower", "Moonlight", "Calm Mind"],
+    "Toxapex": ["Surf", "Toxic", "Recover", "Haze"],
+    "Iron Valiant": ["Moonblast", "Close Combat", "Knock Off", "Swords Dance"],
+    "Dragapult": ["Dragon Darts", "Phantom Force", "U-turn", "Will-O-Wisp"],
+    "Volcarona": ["Fiery Dance", "Bug Buzz", "Quiver Dance", "Giga Drain"],
+    "Ting-Lu": ["Earthquake", "Ruination", "Spikes", "Whirlwind"],
+    "Skeledirge": ["Torch Song", "Shadow Ball", "Slack Off", "Will-O-Wisp"],
+    "Meowscarada": ["Flower Trick", "Knock Off", "Triple Axel", "U-turn"],
+    "Quaquaval": ["Aqua Step", "Close Combat", "Ice Spinner", "Roost"],
+    "Tyranitar": ["Stone Edge", "Crunch", "Earthquake", "Dragon Dance"],
+    "Azumarill": ["Aqua Jet", "Play Rough", "Liquidation", "Belly Drum"],
+    "Rotom-Wash": ["Hydro Pump", "Volt Switch", "Will-O-Wisp", "Pain Split"],
+    "Scizor": ["Bullet Punch", "U-turn", "Close Combat", "Swords Dance"],
+    "Gengar": ["Shadow Ball", "Sludge Wave", "Focus Blast", "Nasty Plot"],
+    "Lucario": ["Close Combat", "Meteor Mash", "Extreme Speed", "Swords Dance"],
+}
+# moves that do not deal damage, and what they do instead
+BOOSTING_MOVES = {
+    "Swords Dance": [("atk", 2)], "Nasty Plot": [("spa", 2)], "Dragon Dance": [("atk", 1), ("spe", 1)],
+    "Calm Mind": [("spa", 1), ("spd", 1)], "Quiver Dance": [("spa", 1), ("spd", 1), ("spe", 1)],
+    "Curse": [("atk", 1), ("def", 1)], "Belly Drum": [("atk", 6)],
+}
+HEALING_MOVES = {"Recover", "Roost", "Soft-Boiled", "Moonlight", "Slack Off", "Rest", "Pain Split"}
+STATUS_MOVES = {"Thunder Wave": "par", "Toxic": "tox", "Will-O-Wisp": "brn"}
+HAZARD_MOVES = {"Stealth Rock", "Spikes"}
+OTHER_MOVES = {"Haze", "Whirlwind"}
+TERA_TYPES = ["Fairy", "Steel", "Water", "Ground", "Fire", "Ghost", "Normal", "Dragon"]
+TEAM_SIZE = 6
+
+
+def synthetic_random_sets() -> Dict[str, Any]:
+    # randbats-style sets for the species above, keyed the way find_potential_random_set looks them up
+    sets = {}
+    for species, moves in POKEMON.items():
+        sets[species.lower()] = {"roles": {
+            "Main": {"moves": list(moves), "evs": {"atk": 84}},
+            "Alternate": {"moves": moves[:3] + ["Protect"], "ivs": {"spe": 0}},
+        }}
+    return sets
+
+
+class _Side:
+    def __init__(self, role: str, name: str, species: List[str], rng: random.Random):
+        self.role = role
+        self.name = name
+        self.species = species
+        self.hp = [100] * len(species)
+        self.levels = [rng.randint(72, 92) for _ in species]
+        self.active = 0
+        self.status: List[Optional[str]] = [None] * len(species)
+        self.terastallized = False
+
+    def ident(self, slot: Optional[int] = None) -> str:
+        return f"{self.role}a: {self.species[self.active if slot is None else slot]}"
+
+    def switch_line(self, slot: int) -> str:
+        return f"|switch|{self.ident(slot)}|{self.species[slot]}, L{self.levels[slot]}|{self.hp[slot]}/100"
+
+    def bench(self) -> List[int]:
+        return [slot for slot, hp in enumerate(self.hp) if hp > 0 and slot != self.active]
+
+    def hp_text(self) -> str:
+        hp = self.hp[self.active]
+        if hp <= 0:
+            return "0 fnt"
+        status = self.status[self.active]
+        return f"{hp}/100 {status}" if status else f"{hp}/100"
+
+
+def generate_log(rng: random.Random, turns: int = 30, rating: int = 2200) -> Tuple[str, str]:
+    """One battle log of about `turns` turns; returns (log, winner's name).
+
+    The loser's pokemon take hits sized to last about `turns` turns in total. The winner's
+    take small ones and never all faint, so every battle ends with the winner's |win|.
+    """
+    species = rng.sample(sorted(POKEMON), 2 * TEAM_SIZE)
+    names = [f"Player {rng.randrange(10 ** 6)}", f"Player {rng.randrange(10 ** 6)}"]
+    sides = [_Side("p1", names[0], species[:TEAM_SIZE], rng), _Side("p2", names[1], species[TEAM_SIZE:], rng)]
+    winner = rng.randrange(2)
+    timestamp = 1700000000 + rng.randrange(10 ** 7)
+    # about how much HP the loser loses per hit so that its whole team lasts `turns` turns;
+    # it heals no more than that either
+    loser_hit = max(1, int(100 * TEAM_SIZE / max(turns, 1) * 2.2))
+
+    lines = [f"|j|☆{names[0]}", f"|j|☆{names[1]}", f"|t:|{timestamp}", "|gametype|singles"]
+    for side in sides:
+        lines.append(f"|player|{side.role}|{side.name}|{rng.randint(1, 300)}|{rating}")
+    lines += ["|teamsize|p1|6", "|teamsize|p2|6", "|gen|9", "|tier|[Gen 9] Random Battle", "|rated|",
+              "|rule|Species Clause: Limit one of each Pokémon", "|", f"|t:|{timestamp}", "|start"]
+    lines += [side.switch_line(0) for side in sides]
+    turn = 1
+    lines.append(f"|turn|{turn}")
+
+    while True:
+        timestamp += rng.randint(5, 40)
+        lines += ["|", f"|t:|{timestamp}"]
+        movers = []
+        for index, side in enumerate(sides):
+            bench = side.bench()
+            if bench and rng.random() < 0.12:
+                side.active = rng.choice(bench)
+                lines.append(side.switch_line(side.active))
+            else:
+                movers.append(index)
+        rng.shuffle(movers)
+        for index in movers:
+            side, foe = sides[index], sides[1 - index]
+            if side.hp[side.active] <= 0 or foe.hp[foe.active] <= 0:
+                continue
+            if not side.terastallized and rng.random() < 0.05:
+                side.terastallized = True
+                lines.append(f"|-terastallize|{side.ident()}|{rng.choice(TERA_TYPES)}")
+            move = rng.choice(POKEMON[side.species[side.active]])
+            if index == winner:
+                _use_move(lines, rng, side, foe, move, damage=loser_hit, heal=25, foe_is_winner=False)
+            else:
+                _use_move(lines, rng, side, foe, move, damage=rng.randint(3, 20), heal=loser_hit, foe_is_winner=True)
+
+        # replace fainted pokemon; the battle is over once the loser has none left
+        lines.append("|")
+        over = False
+        for index, side in enumerate(sides):
+            if side.hp[side.active] > 0:
+                continue
+            bench = side.bench()
+            if not bench:
+                over = True
+                break
+            side.active = rng.choice(bench)
+            lines.append(side.switch_line(side.active))
+        if over:
+            lines.append(f"|win|{names[winner]}")
+            break
+        lines.append("|upkeep")
+        turn += 1
+        lines.append(f"|turn|{turn}")
+        if turn > turns:
+            # past the requested length the loser's pokemon go down in one hit each
+            loser_hit = 100
+    return "\n".join(lines) + "\n", names[winner]
+
+
+def _use_move(lines: List[str], rng: random.Random, side: _Side, foe: _Side, move: str, damage: int, heal: int, foe_is_winner: bool) -> None:
+    if move in BOOSTING_MOVES:
+        lines.append(f"|move|{side.ident()}|{move}|{side.ident()}")
+        for stat, amount in BOOSTING_MOVES[move]:
+            lines.append(f"|-boost|{side.ident()}|{stat}|{amount}")
+        return
+    if move in HEALING_MOVES:
+        lines.append(f"|move|{side.ident()}|{move}|{side.ident()}")
+        side.hp[side.active] = min(100, side.hp[side.active] + heal)
+        lines.append(f"|-heal|{side.ident()}|{side.hp_text()}")
+        return
+    if move in HAZARD_MOVES:
+        lines.append(f"|move|{side.ident()}|{move}|{foe.ident()}")
+        lines.append(f"|-sidestart|{foe.role}: {foe.name}|move: {move}")
+        return
+    if move in OTHER_MOVES:
+        lines.append(f"|move|{side.ident()}|{move}|{foe.ident()}")
+        return
+    if move in STATUS_MOVES:
+        lines.append(f"|move|{side.ident()}|{move}|{foe.ident()}")
+        if foe.status[foe.active] is None:
+            foe.status[foe.active] = STATUS_MOVES[move]
+            lines.append(f"|-status|{foe.ident()}|{STATUS_MOVES[move]}")
+        return
+
+    lines.append(f"|move|{side.ident()}|{move}|{foe.ident()}")
+    if rng.random() < 0.2:
+        lines.append(f"|-supereffective|{foe.ident()}")
+    hp = foe.hp[foe.active] - damage
+    if foe_is_winner and hp <= 0 and not foe.bench():
+        # the winner's last pokemon standing always survives
+        hp = 1
+    foe.hp[foe.active] = max(hp, 0)
+    lines.append(f"|-damage|{foe.ident()}|{foe.hp_text()}")
+    if foe.hp[foe.active] <= 0:
+        lines.append(f"|faint|{foe.ident()}")
+
+
+def generate_corpus(
+    battles: int, seed: int = 0, min_turns: int = 15, max_turns: int = 45, start: int = 0
+) -> Iterator[Dict[str, Any]]:
+    # rows shaped like battle_logs.parquet rows, generated one at a time
+    for i in range(start, start + battles):
+        rng = random.Random(f"{seed}:{i}")
+        rating = rng.randint(1800, 2600)
+        log, _ = generate_log(rng, rng.randint(min_turns, max_turns), rating)
+        yield {"battle_id": f"gen9randombattle-synthetic-{seed}-{i}", "rating": rating, "log_content": log}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--battles", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-turns", type=int, default=15)
+    parser.add_argument("--max-turns", type=int, default=45)
+    parser.add_argument("--output", default="data/synthetic_battle_logs.parquet")
+    parser.add_argument("--store", help="Write a replay store directory instead of a parquet file")
+    args = parser.parse_args()
+
+    rows = generate_corpus(args.battles, args.seed, args.min_turns, args.max_turns)
+    if args.store:
+        from replay_store import ReplayStoreWriter
+
+        with ReplayStoreWriter(args.store) as writer:
+            for row in rows:
+                writer.add(row["battle_id"], row["rating"], row["log_content"])
+        print(f"Wrote {args.battles} synthetic battles to {args.store}")
+    else:
+        import pyarrow as pa
+        from parquet_stream import StreamingParquetWriter
+
+        schema = pa.schema([("battle_id", pa.string()), ("rating", pa.int64()), ("log_content", pa.string())])
+        with StreamingParquetWriter(args.output, schema) as writer:
+            writer.write_rows(rows)
+        print(f"Wrote {writer.rows_written} synthetic battles to {args.output}")
@@ -1,23 +1,48 @@
-import pandas as pd
-from tqdm import tqdm
+from parquet_stream import StreamingParquetWriter, iter_parquet_rows, parquet_schema
+from sampling_spec import CLEAN_FILTER_SPEC, read_sampling_spec
+from state_dedupe import STATE_HASH_COLUMN
 
-# Read the parquet file
-df = pd.read_parquet("data/battle_logs_with_prompts.parquet")
+input_path = "data/battle_logs_with_prompts.parquet"
+output_path = "data/battle_logs_with_prompts_cleaned.parquet"
 
-# Remove rows where prompts are empty
-df_cleaned = df[df['prompts'].apply(lambda x: len(x) > 0)]
+# Structured output keeps per-turn prompt fields instead of rendered texts; both are filtered the same way
+schema = parquet_schema(input_path)
+prompts_column = "prompt_fields" if "prompt_fields" in schema.names else "prompts"
+# Deduplicated prompts carry a state hash per prompt, which is kept in step with them
+has_state_hashes = STATE_HASH_COLUMN in schema.names
 
-# Remove rows where the lens of prompts is greater than 50
-df_cleaned = df_cleaned[df_cleaned['prompts'].apply(lambda x: len(x) <= 50)]
+# Prompts generated with a sampling spec were already filtered and sampled before any
+# damage calc was spent on them; only unsampled files still go through the filters here
+spec = None if read_sampling_spec(schema) is not None else CLEAN_FILTER_SPEC
 
-# Go into each prompt list and remove alternating prompts
-df_cleaned['prompts'] = df_cleaned['prompts'].apply(lambda x: x[::2])
+# Read the parquet file a row group at a time and stream the kept rows to the new file
+total_rows = 0
+total_prompts = 0
+with StreamingParquetWriter(output_path, schema) as writer:
+    for row in iter_parquet_rows(input_path):
+        total_rows += 1
 
-# Save to new parquet file with progress bar
-df_cleaned.to_parquet("data/battle_logs_with_prompts_cleaned.parquet", engine="pyarrow")
+        # Remove rows where prompts are empty
+        if len(row[prompts_column]) == 0:
+            continue
+
+        if spec is not None:
+            # Remove rows with too many prompts (more than 50 by default)
+            if not spec.keeps_battle(row["rating"], len(row[prompts_column])):
+                continue
+
+            # Go into each prompt list and keep the sampled prompts (every other one by default)
+            turns = spec.select_turns(row["battle_id"], len(row[prompts_column]))
+            if not turns:
+                continue
+            row[prompts_column] = [row[prompts_column][turn] for turn in turns]
+            if has_state_hashes:
+                row[STATE_HASH_COLUMN] = [row[STATE_HASH_COLUMN][turn] for turn in turns]
+        total_prompts += len(row[prompts_column])
+        writer.write_row(row)
 
 # Print total amount of rows removed
-print(f"Total rows removed: {df.shape[0] - df_cleaned.shape[0]}")
+print(f"Total rows removed: {total_rows - writer.rows_written}")
 
 # Print total amount of prompts in the dataset
-print(f"Total prompts in the dataset: {df_cleaned['prompts'].apply(len).sum()}")
\ No newline at end of file
+print(f"Total prompts in the dataset: {total_prompts}")
@@ -0,0 +1,33 @@
+// Batched @smogon/calc entry point used by damage_engine.py.
+// The calc module is handed in once by the Python side, and every batch of
+// (attacker, defender, move) queries is evaluated in a single bridge call.
+module.exports = function (calc) {
+  const generation = calc.Generations.get(9)
+
+  function newPokemon (name, attributes) {
+    try {
+      return new calc.Pokemon(generation, name, attributes)
+    } catch (e) {
+      // fall back to the base forme, e.g. "Urshifu-Rapid-Strike" -> "Urshifu"
+      return new calc.Pokemon(generation, name.split('-')[0], attributes)
+    }
+  }
+
+  function calculateOne ([attackerName, attackerAttributes, defenderName, defenderAttributes, moveName]) {
+    try {
+      const attacker = newPokemon(attackerName, attackerAttributes)
+      const defender = newPokemon(defenderName, defenderAttributes)
+      const move = new calc.Move(generation, moveName)
+      const result = calc.calculate(generation, attacker, defender, move)
+      return { damage: result.damage, originalCurHP: defender.originalCurHP }
+    } catch (e) {
+      return { error: String(e) }
+    }
+  }
+
+  return {
+    calculateBatch (queriesJson) {
+      return JSON.stringify(JSON.parse(queriesJson).map(calculateOne))
+    }
+  }
+}
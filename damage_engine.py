@@ -0,0 +1,250 @@
+from typing import Any, Dict, List, Optional, Tuple, Union
+from collections import OrderedDict
+from instrumentation import metrics
+import hashlib
+import json
+import sqlite3
+import time
+
+import native_damage
+
+# (attacker, defender, move, opponent) as passed to calculate_damage
+DamageQuery = Tuple[dict, dict, str, bool]
+DamageRange = Tuple[Union[str, int], Union[str, int]]
+
+
+# bump whenever the calc inputs or @smogon/calc itself change, so stale on-disk entries are ignored
+CACHE_VERSION = 1
+
+
+def _calc_attributes(pokemon: dict) -> Dict[str, Any]:
+    attributes = {}
+    if "level" in pokemon:
+        attributes["level"] = pokemon.get("level")
+    if "item" in pokemon:
+        attributes["item"] = pokemon.get("item")
+    if "boosts" in pokemon:
+        # evasion and accuracy are not stats the calc knows about; copy rather than
+        # deleting them so the caller's (live) boosts dict is left alone
+        attributes["boosts"] = {
+            stat: boost for stat, boost in pokemon["boosts"].items() if stat not in ("evasion", "accuracy")
+        }
+    if "tera" in pokemon:
+        attributes["teraType"] = pokemon.get("tera")
+    if "evs" in pokemon:
+        attributes["evs"] = pokemon.get("evs")
+    if "ivs" in pokemon:
+        attributes["ivs"] = pokemon.get("ivs")
+    return attributes
+
+
+def _damage_percentages(result: Dict[str, Any], query: DamageQuery, log: bool = False) -> DamageRange:
+    atkr, defdr, move_used, opponent = query
+    if "error" in result:
+        raise RuntimeError(
+            f"Damage calculation failed for {atkr.get('name')} vs {defdr.get('name')} using {move_used}: {result['error']}"
+        )
+    damage = result["damage"]
+    if log:
+        print("Attacker: ", atkr)
+        print("Defender: ", defdr)
+        print("Defender HP: ", result["originalCurHP"])
+        print("Move: ", move_used)
+        print("RESULT: ", damage)
+    if damage == 0:
+        return 0, 0
+    if isinstance(damage, str):
+        return damage + "%", damage + "%"
+    try:
+        if isinstance(damage, (int, float)):
+            min_dmg = damage
+            max_dmg = damage
+        else:
+            min_dmg = min(damage)
+            max_dmg = max(damage)
+    except:
+        print("INPUTS: ", atkr.get("name"), defdr.get("name"), move_used)
+        print(atkr)
+        print(defdr)
+        print("ERROR: ", damage)
+        raise
+
+    # calculate the percentage of damage
+    hp = defdr.get("hp")
+    if log:
+        print("DEFENDER HP Ratio: ", hp)
+        print("MIN DMG: ", min_dmg)
+        print("MAX DMG: ", max_dmg)
+        print("MOVE USED: ", move_used)
+    if hp == 0:
+        return "100%", "100%"
+    if hp == None:
+        hp = defdr.get("maximum hp")
+    if opponent:
+        min_dmg_percent = int(
+            min_dmg / (result["originalCurHP"] * (hp / 100.0)) * 100
+        )
+        max_dmg_percent = int(
+            max_dmg / (result["originalCurHP"] * (hp / 100.0)) * 100
+        )
+    else:
+        min_dmg_percent = int(min_dmg / hp * 100)
+        max_dmg_percent = int(max_dmg / hp * 100)
+    return str(min_dmg_percent) + "%", str(max_dmg_percent) + "%"
+
+
+def _cache_key(calc_input: list) -> str:
+    canonical = json.dumps(calc_input, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(f"{CACHE_VERSION}:{canonical}".encode()).hexdigest()
+
+
+class DamageCache:
+    """Content-addressed cache of raw @smogon/calc results.
+
+    Entries are keyed on the canonical calc input (species, level, item, tera, boosts,
+    evs, ivs and move of both sides) and hold the raw damage rolls, so the hp-dependent
+    percentages are still worked out per query. A bounded LRU lives in memory; when
+    `path` is given, results are also persisted to an sqlite file that is shared across
+    runs and processes.
+    """
+
+    def __init__(self, max_entries: int = 65536, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=30)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS damage (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+            self._db.commit()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: str, result: Dict[str, Any]) -> None:
+        self._entries[key] = result
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        result = self._entries.get(key)
+        if result is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+        if self._db is not None:
+            row = self._db.execute("SELECT result FROM damage WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                result = json.loads(row[0])
+                self._remember(key, result)
+                self.hits += 1
+                return result
+        self.misses += 1
+        return None
+
+    def put_many(self, entries: List[Tuple[str, Dict[str, Any]]]) -> None:
+        for key, result in entries:
+            self._remember(key, result)
+        if self._db is not None and entries:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO damage (key, result) VALUES (?, ?)",
+                [(key, json.dumps(result)) for key, result in entries],
+            )
+            self._db.commit()
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+class DamageEngine:
+    """Long-lived @smogon/calc context that evaluates whole batches of damage queries
+    in a single bridge call.
+
+    The calc module and the batch entry point in damage_calc.js are loaded once, on
+    first use, and reused for every following batch. Queries already in `cache` never
+    reach the bridge. With `native`, the plain single-hit queries native_damage handles
+    are computed in-process and skip both the cache and the bridge; it is off until
+    `python native_damage.py` has run clean against @smogon/calc on the corpus.
+    """
+
+    def __init__(self, cache: Optional[DamageCache] = None, native: bool = False):
+        self._calculator = None
+        self.cache: DamageCache = cache if cache is not None else DamageCache()
+        self.native = native
+
+    def _get_calculator(self):
+        if self._calculator is None:
+            # importing the bridge starts Node, so it is deferred until a calc is actually needed
+            from javascript import require
+
+            self._calculator = require("./damage_calc.js")(require("@smogon/calc"))
+        return self._calculator
+
+    def calculate_batch(self, queries: List[DamageQuery], log: bool = False) -> List[DamageRange]:
+        if not queries:
+            return []
+        calc_inputs = [
+            [atkr.get("name"), _calc_attributes(atkr), defdr.get("name"), _calc_attributes(defdr), move_used]
+            for atkr, defdr, move_used, _ in queries
+        ]
+        results: List[Optional[Dict[str, Any]]] = [None] * len(calc_inputs)
+        if self.native:
+            results = [native_damage.calculate(calc_input) for calc_input in calc_inputs]
+        # index -> cache key of the queries left to @smogon/calc
+        keys: Dict[int, str] = {}
+        hits, misses = self.cache.hits, self.cache.misses
+        for i, result in enumerate(results):
+            if result is None:
+                keys[i] = _cache_key(calc_inputs[i])
+                results[i] = self.cache.get(keys[i])
+
+        # only the misses (deduplicated) cross the bridge
+        pending: Dict[str, int] = {}
+        for i, key in keys.items():
+            if results[i] is None and key not in pending:
+                pending[key] = i
+        metrics.incr("damage_queries", len(queries))
+        metrics.incr("damage_native", len(queries) - len(keys))
+        cache_misses = self.cache.misses - misses
+        metrics.incr("damage_cache_hits", self.cache.hits - hits)
+        metrics.incr("damage_cache_misses", cache_misses)
+        # misses that repeat another query of the batch ride along on its calc
+        metrics.incr("damage_batch_duplicates", cache_misses - len(pending))
+        if pending:
+            payload = [calc_inputs[i] for i in pending.values()]
+            calculator = self._get_calculator()
+            start = time.perf_counter()
+            calculated = json.loads(calculator.calculateBatch(json.dumps(payload)))
+            metrics.observe("damage_bridge_seconds", time.perf_counter() - start)
+            fresh = dict(zip(pending.keys(), calculated))
+            self.cache.put_many([(key, result) for key, result in fresh.items() if "error" not in result])
+            for i, key in keys.items():
+                if results[i] is None:
+                    results[i] = fresh[key]
+        return [_damage_percentages(result, query, log) for result, query in zip(results, queries)]
+
+
+_shared_engine: Optional[DamageEngine] = None
+
+
+def get_damage_engine(cache_path: Optional[str] = None, native: bool = False) -> DamageEngine:
+    # one engine (and one JS context) per process; the first call decides where its cache
+    # persists and whether plain queries are calculated natively
+    global _shared_engine
+    if _shared_engine is None:
+        _shared_engine = DamageEngine(DamageCache(path=cache_path), native=native)
+    return _shared_engine
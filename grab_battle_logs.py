@@ -1,44 +1,171 @@
-import pandas as pd
-import requests
+from typing import Dict, Iterator, List, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+import argparse
 import json
-from tqdm import tqdm
-
-# Read the replays.jsonl file
-replays = []
-with open('data/replays.jsonl', 'r') as f:
-    for line in f:
-        replays.append(json.loads(line))
-
-# Create a list to store the data
-data = []
-
-# Iterate through the replays and fetch the battle logs
-for replay in tqdm(replays, desc="Fetching battle logs"):
-    battle_id = replay['id']
-    rating = replay['rating']
-    
-    # Construct the URL for the battle log
-    url = f"https://replay.pokemonshowdown.com/{battle_id}.log"
-    
-    # Fetch the battle log
-    response = requests.get(url)
-    
-    if response.status_code == 200:
-        log_content = response.text
-        
-        # Append the data to our list
-        data.append({
-            'battle_id': battle_id,
-            'rating': rating,
-            'log_content': log_content
-        })
-    else:
-        print(f"Failed to fetch log for battle {battle_id}")
-
-# Create a pandas DataFrame
-df = pd.DataFrame(data)
-
-# Write the DataFrame to a parquet file
-df.to_parquet('data/battle_logs.parquet')
-
-print("Battle logs have been saved to battle_logs.parquet")
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_URL = "https://replay.pokemonshowdown.com"
+
+
+class RateLimiter:
+    # Spaces out calls from any number of threads to at most `rate` per second
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def make_session(pool_size: int, retries: int = 5, backoff: float = 0.5) -> requests.Session:
+    # One keep-alive connection pool shared by all threads; transient errors and 429/5xx
+    # responses are retried with exponential backoff (honoring Retry-After)
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["GET"],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def fetch_log(session: requests.Session, limiter: RateLimiter, base_url: str, battle_id: str) -> Tuple[int, Optional[str]]:
+    limiter.wait()
+    try:
+        response = session.get(f"{base_url}/{battle_id}.log", timeout=30)
+    except requests.RequestException as e:
+        print(f"Failed to fetch log for battle {battle_id}: {e}")
+        return 0, None
+    if response.status_code != 200:
+        return response.status_code, None
+    return response.status_code, response.text
+
+
+def read_manifest(path: str) -> Dict[str, int]:
+    # battle id -> offset of its line in the staging file. A line torn by an interrupted
+    # run is cut off, so appending resumes on a clean line.
+    offsets: Dict[str, int] = {}
+    if not os.path.exists(path):
+        return offsets
+    with open(path, "r+b") as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            offsets[json.loads(line)["battle_id"]] = offset
+            offset += len(line)
+        f.truncate(offset)
+    return offsets
+
+
+def download_logs(
+    replays: List[Dict],
+    manifest_path: str,
+    base_url: str = BASE_URL,
+    workers: int = 8,
+    rate: float = 10.0,
+) -> Dict[str, int]:
+    """Downloads the log of every replay that is not in the manifest yet.
+
+    Every downloaded log is appended to the manifest, a jsonl staging file, as soon as it
+    arrives, so an interrupted run keeps everything fetched so far and a rerun only fetches
+    what is missing. At most `workers` requests are in flight, started at no more than
+    `rate` per second. Returns the manifest offsets of all downloaded logs.
+    """
+    from tqdm import tqdm
+
+    offsets = read_manifest(manifest_path)
+    pending = [replay for replay in replays if replay["id"] not in offsets]
+    print(f"{len(offsets)} logs already downloaded, {len(pending)} to fetch")
+
+    session = make_session(workers)
+    limiter = RateLimiter(rate)
+    failed = 0
+    with open(manifest_path, "ab") as manifest, ThreadPoolExecutor(workers) as executor, tqdm(
+        total=len(pending), desc="Fetching battle logs"
+    ) as progress:
+        in_flight: Dict[Future, Dict] = {}
+        replay_iter: Iterator[Dict] = iter(pending)
+        while True:
+            # keep a couple of requests per worker queued, not the whole list
+            for replay in replay_iter:
+                in_flight[executor.submit(fetch_log, session, limiter, base_url, replay["id"])] = replay
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                replay = in_flight.pop(future)
+                status, log_content = future.result()
+                progress.update(1)
+                if log_content is None:
+                    failed += 1
+                    if status:
+                        print(f"Failed to fetch log for battle {replay['id']} (HTTP {status})")
+                    continue
+                line = json.dumps({"battle_id": replay["id"], "rating": replay["rating"], "log_content": log_content})
+                offsets[replay["id"]] = manifest.tell()
+                manifest.write(line.encode() + b"\n")
+                manifest.flush()
+    if failed:
+        print(f"{failed} logs could not be fetched; rerun to retry them")
+    return offsets
+
+
+def write_battle_logs(replays: List[Dict], manifest_path: str, offsets: Dict[str, int], output_path: str) -> int:
+    # Streams the downloaded logs, in replay order, from the staging file into the parquet file
+    import pyarrow as pa
+    from parquet_stream import StreamingParquetWriter
+
+    schema = pa.schema([("battle_id", pa.string()), ("rating", pa.int64()), ("log_content", pa.string())])
+    with open(manifest_path, "rb") as manifest, StreamingParquetWriter(output_path, schema, row_group_size=1000) as writer:
+        for replay in replays:
+            offset = offsets.get(replay["id"])
+            if offset is None:
+                continue
+            manifest.seek(offset)
+            writer.write_row(json.loads(manifest.readline()))
+    return writer.rows_written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download the battle log of every replay")
+    parser.add_argument("--replays", default="data/replays.jsonl")
+    parser.add_argument("--output", default="data/battle_logs.parquet")
+    # downloaded logs are staged here; rerunning skips every battle already in it
+    parser.add_argument("--manifest", default="data/battle_logs.jsonl")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=10.0, help="Maximum requests per second")
+    args = parser.parse_args()
+
+    # Read the replays.jsonl file
+    replays = []
+    with open(args.replays, 'r') as f:
+        for line in f:
+            replays.append(json.loads(line))
+
+    offsets = download_logs(replays, args.manifest, base_url=args.base_url, workers=args.workers, rate=args.rate)
+    rows = write_battle_logs(replays, args.manifest, offsets, args.output)
+
+    print(f"{rows} battle logs have been saved to {args.output}")
@@ -0,0 +1,190 @@
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+from bisect import bisect_left
+from contextlib import contextmanager
+import json
+import os
+import time
+
+# (name, sorted label pairs)
+MetricKey = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+# upper bounds, in seconds, of the latency histogram buckets; the last bucket is +Inf
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+PROMETHEUS_PREFIX = "pokemon_pipeline"
+
+
+def _key(name: str, labels: Dict[str, str]) -> MetricKey:
+    return name, tuple(sorted(labels.items()))
+
+
+class Histogram:
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Counters, stage timers and histograms of one process.
+
+    Everything is a plain in-memory update, cheap enough to leave on in the per-turn code.
+    `snapshot` turns the current values into a JSON-friendly dict that `merge` adds into
+    another Metrics, which is how pool workers report to the parent process.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.started_at = time.time()
+        self.counters: Dict[MetricKey, float] = {}
+        # stage -> [calls, seconds]
+        self.timers: Dict[str, List[float]] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    def incr(self, name: str, value: float = 1, **labels: str) -> None:
+        key = _key(name, labels) if labels else (name, ())
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def add_time(self, stage: str, seconds: float, calls: int = 1) -> None:
+        timer = self.timers.get(stage)
+        if timer is None:
+            timer = self.timers[stage] = [0, 0.0]
+        timer[0] += calls
+        timer[1] += seconds
+
+    @contextmanager
+    def timed(self, stage: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def observe(self, name: str, value: float) -> None:
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(value)
+
+    def counter(self, name: str, **labels: str) -> float:
+        return self.counters.get(_key(name, labels), 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()
+            ],
+            "timers": {stage: {"calls": calls, "seconds": seconds} for stage, (calls, seconds) in self.timers.items()},
+            "histograms": {
+                name: {"bounds": list(h.bounds), "counts": h.counts, "sum": h.sum, "count": h.count}
+                for name, h in self.histograms.items()
+            },
+        }
+
+    def merge(self, snapshot: Dict[str, Any]) -> None:
+        for counter in snapshot["counters"]:
+            self.incr(counter["name"], counter["value"], **counter["labels"])
+        for stage, timer in snapshot["timers"].items():
+            self.add_time(stage, timer["seconds"], timer["calls"])
+        for name, data in snapshot["histograms"].items():
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(data["bounds"])
+            histogram.counts = [a + b for a, b in zip(histogram.counts, data["counts"])]
+            histogram.sum += data["sum"]
+            histogram.count += data["count"]
+
+    def summary(self) -> Dict[str, Any]:
+        # the rates and ratios worth looking at first, over the wall time since the last reset
+        elapsed = time.time() - self.started_at
+        queries = self.counter("damage_queries")
+        hits, misses = self.counter("damage_cache_hits"), self.counter("damage_cache_misses")
+        errors: Dict[str, float] = {}
+        for (name, labels), value in self.counters.items():
+            if name == "errors":
+                errors[dict(labels).get("type", "")] = value
+        return {
+            "elapsed_seconds": elapsed,
+            "turns_per_second": self.counter("turns") / elapsed if elapsed else 0.0,
+            "battles_per_second": self.counter("battles") / elapsed if elapsed else 0.0,
+            "damage_calcs_per_second": queries / elapsed if elapsed else 0.0,
+            "damage_native_share": self.counter("damage_native") / queries if queries else 0.0,
+            "damage_cache_hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "errors": errors,
+            "stage_seconds": {stage: seconds for stage, (_, seconds) in sorted(self.timers.items(), key=lambda item: -item[1][1])},
+        }
+
+    def to_json(self) -> str:
+        return json.dumps({"summary": self.summary(), **self.snapshot()}, indent=2)
+
+    def to_prometheus(self, prefix: str = PROMETHEUS_PREFIX) -> str:
+        lines: List[str] = []
+        by_name: Dict[str, List[Tuple[Tuple[Tuple[str, str], ...], float]]] = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            by_name.setdefault(name, []).append((labels, value))
+        for name, values in by_name.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            for labels, value in values:
+                lines.append(f"{prefix}_{name}_total{_prometheus_labels(labels)} {value}")
+        if self.timers:
+            lines.append(f"# TYPE {prefix}_stage_seconds_total counter")
+            for stage, (_, seconds) in sorted(self.timers.items()):
+                lines.append(f'{prefix}_stage_seconds_total{{stage="{stage}"}} {seconds}')
+            lines.append(f"# TYPE {prefix}_stage_calls_total counter")
+            for stage, (calls, _) in sorted(self.timers.items()):
+                lines.append(f'{prefix}_stage_calls_total{{stage="{stage}"}} {calls}')
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(f"# TYPE {prefix}_{name} histogram")
+            cumulative = 0
+            for bound, count in zip(list(histogram.bounds) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f'{prefix}_{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f"{prefix}_{name}_sum {histogram.sum}")
+            lines.append(f"{prefix}_{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str) -> None:
+        # Prometheus text format for .prom/.txt files, JSON otherwise
+        text = self.to_prometheus() if os.path.splitext(path)[1] in (".prom", ".txt") else self.to_json()
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+
+def _prometheus_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+# The metrics of this process, updated by the pipeline modules
+metrics = Metrics()
+
+
+@contextmanager
+def profiled(output_path: Optional[str] = None, top: int = 30) -> Iterator[None]:
+    """Runs the block under cProfile, printing the `top` functions by cumulative time.
+
+    The raw stats go to `output_path` when given, for snakeviz or pstats. Meant for a
+    single battle: profiling slows everything inside the block down several times.
+    """
+    import cProfile
+    import pstats
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        if output_path:
+            profiler.dump_stats(output_path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
@@ -0,0 +1,44 @@
+from typing import Dict, Optional
+import csv
+import json
+import os
+
+# Static move and item tables, built once per process on first use and keyed by the same
+# ids poke-env uses (lowercase, alphanumeric only), so every lookup is a single dict access.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+_move_effects: Optional[Dict[str, Optional[str]]] = None
+_item_names: Optional[Dict[str, str]] = None
+
+
+def to_id(name: str) -> str:
+    # same normalization as poke_env.data.to_id_str
+    return "".join(char for char in name if char.isalnum()).lower()
+
+
+def move_effects() -> Dict[str, Optional[str]]:
+    global _move_effects
+    if _move_effects is None:
+        effects: Dict[str, Optional[str]] = {}
+        with open(os.path.join(DATA_DIR, "moves.csv"), newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                # the first row wins, like the DataFrame lookup this replaces
+                effects.setdefault(to_id(row["name"]), row["effect"] or None)
+        _move_effects = effects
+    return _move_effects
+
+
+def item_names() -> Dict[str, str]:
+    global _item_names
+    if _item_names is None:
+        with open(os.path.join(DATA_DIR, "items.json"), encoding="utf-8") as f:
+            _item_names = json.load(f)
+    return _item_names
+
+
+def find_move_effect(move_id: str) -> Optional[str]:
+    return move_effects().get(move_id)
+
+
+def find_item_name(item_id: Optional[str]) -> str:
+    return item_names().get(item_id, "")
@@ -0,0 +1,386 @@
+"""In-process gen 9 damage calc for the common case, with @smogon/calc as the reference.
+
+`calculate` takes the same [attacker name, attributes, defender name, attributes, move]
+input as damage_calc.js and returns the same {"damage": [16 rolls], "originalCurHP": ...}
+result, following the standard gen 9 formula of @smogon/calc (stats from base stats, level,
+EVs and IVs with a neutral nature, boosts, STAB and tera STAB, the tera 60 base power floor,
+type effectiveness and the 16 random rolls). Like the JS calc it is handed no field, status
+or ability, so every pokemon has its species' first ability.
+
+Anything outside that is left to @smogon/calc: moves with variable power, type, hit count
+or stats; abilities and items other than the allowlisted ones; species or moves poke-env
+does not know. For those `calculate` returns None and DamageEngine sends them over the
+bridge as before. Run this module to compare both over a corpus:
+
+    python native_damage.py --input data/battle_logs.parquet --battles 500
+"""
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from collections import Counter
+import argparse
+import json
+
+from lookup_tables import to_id
+
+GEN = 9
+
+# Move fields of the poke-env move data marking power, type, effectiveness, stat or hit
+# count rules only @smogon/calc implements
+SPECIAL_MOVE_FIELDS = frozenset([
+    "basePowerCallback", "onBasePower", "onModifyType", "onModifyMove", "damageCallback",
+    "onEffectiveness", "overrideOffensiveStat", "overrideOffensivePokemon", "overrideDefensiveStat",
+    "multihit", "multiaccuracy", "damage", "ohko", "willCrit", "ignoreDefensive", "ignoreImmunity",
+    "onTry", "onTryMove", "onTryHit", "onTryImmunity", "onPrepareHit", "isZ", "isMax",
+])
+# Moves @smogon/calc special-cases by name without a matching field above
+SPECIAL_MOVES = frozenset(["naturepower", "struggle"])
+
+# Abilities that do nothing to a single hit at full HP without field, status or abilityOn
+NEUTRAL_ABILITIES = frozenset([
+    "Aftermath", "Anger Shell", "Anticipation", "Aroma Veil", "Bad Dreams",
+    "Ball Fetch", "Battle Armor", "Beast Boost", "Big Pecks", "Blaze", "Cheek Pouch",
+    "Chlorophyll", "Clear Body", "Color Change", "Competitive", "Compound Eyes", "Corrosion",
+    "Cotton Down", "Cud Chew", "Curious Medicine", "Cursed Body", "Cute Charm", "Damp",
+    "Defiant", "Early Bird", "Effect Spore", "Emergency Exit", "Flame Body",
+    "Flower Veil", "Forewarn", "Frisk", "Gluttony", "Good as Gold", "Gooey", "Guts", "Harvest",
+    "Healer", "Honey Gather", "Hospitality", "Hydration", "Hyper Cutter", "Ice Body",
+    "Illuminate", "Immunity", "Inner Focus", "Insomnia", "Iron Barbs", "Justified", "Keen Eye",
+    "Leaf Guard", "Light Metal", "Limber", "Lingering Aroma", "Liquid Ooze", "Magic Bounce",
+    "Magic Guard", "Magician", "Magma Armor", "Magnet Pull", "Marvel Scale", "Merciless",
+    "Mummy", "Natural Cure", "No Guard", "Oblivious", "Opportunist", "Overcoat", "Overgrow",
+    "Own Tempo", "Persistent", "Pickup", "Poison Point", "Poison Touch", "Prankster", "Pressure",
+    "Quick Draw", "Rattled", "Regenerator", "Ripen", "Rock Head", "Rough Skin", "Run Away",
+    "Sand Rush", "Sand Spit", "Sand Veil", "Serene Grace", "Shadow Tag", "Shed Skin",
+    "Shell Armor", "Shield Dust", "Snow Cloak", "Speed Boost", "Stamina", "Static", "Steadfast",
+    "Steam Engine", "Stench", "Sticky Hold", "Sturdy", "Suction Cups", "Swarm", "Sweet Veil",
+    "Swift Swim", "Synchronize", "Tangled Feet", "Telepathy", "Torrent", "Toxic Chain",
+    "Toxic Debris", "Unburden", "Unnerve", "Vital Spirit", "Wandering Spirit", "Water Compaction",
+    "Water Veil", "Weak Armor", "White Smoke", "Wimp Out", "Wind Power",
+])
+# Defender abilities that make it immune to a move type
+IMMUNITY_ABILITIES = {
+    "Levitate": "Ground", "Earth Eater": "Ground", "Flash Fire": "Fire", "Well-Baked Body": "Fire",
+    "Water Absorb": "Water", "Storm Drain": "Water", "Volt Absorb": "Electric",
+    "Lightning Rod": "Electric", "Motor Drive": "Electric", "Sap Sipper": "Grass",
+}
+# Defender abilities that make it immune to moves with positive priority
+PRIORITY_IMMUNITY_ABILITIES = frozenset(["Armor Tail", "Dazzling", "Queenly Majesty"])
+HANDLED_ABILITIES = NEUTRAL_ABILITIES | frozenset(IMMUNITY_ABILITIES) | PRIORITY_IMMUNITY_ABILITIES | frozenset(["Huge Power", "Pure Power", "Thick Fat"])
+
+# Held items raising the base power of moves of one type by 4915/4096
+TYPE_BOOST_ITEMS = {
+    "Black Belt": "Fighting", "Black Glasses": "Dark", "Charcoal": "Fire", "Dragon Fang": "Dragon",
+    "Fairy Feather": "Fairy", "Hard Stone": "Rock", "Magnet": "Electric", "Metal Coat": "Steel",
+    "Miracle Seed": "Grass", "Mystic Water": "Water", "Never-Melt Ice": "Ice", "Poison Barb": "Poison",
+    "Sharp Beak": "Flying", "Silk Scarf": "Normal", "Silver Powder": "Bug", "Soft Sand": "Ground",
+    "Spell Tag": "Ghost", "Twisted Spoon": "Psychic",
+}
+# Items that do nothing to a single hit without field or status
+NEUTRAL_ITEMS = frozenset([
+    "", "Ability Shield", "Adrenaline Orb", "Aguav Berry", "Big Root", "Binding Band", "Black Sludge",
+    "Blunder Policy", "Bright Powder", "Chesto Berry", "Choice Scarf", "Clear Amulet", "Covert Cloak",
+    "Damp Rock", "Destiny Knot", "Eject Button", "Eject Pack", "Figy Berry", "Focus Sash", "Grip Claw",
+    "Heat Rock", "Heavy-Duty Boots", "Iapapa Berry", "Icy Rock", "King's Rock", "Lagging Tail",
+    "Leftovers", "Leppa Berry", "Light Clay", "Loaded Dice", "Lum Berry", "Mago Berry", "Mental Herb",
+    "Mirror Herb", "Oran Berry", "Power Herb", "Protective Pads", "Quick Claw", "Razor Claw",
+    "Razor Fang", "Red Card", "Rocky Helmet", "Safety Goggles", "Scope Lens", "Shed Shell",
+    "Shell Bell", "Sitrus Berry", "Smooth Rock", "Sticky Barb", "Terrain Extender", "Throat Spray",
+    "Utility Umbrella", "White Herb", "Wide Lens", "Wiki Berry", "Zoom Lens",
+])
+HANDLED_ITEMS = NEUTRAL_ITEMS | frozenset(TYPE_BOOST_ITEMS) | frozenset([
+    "Assault Vest", "Choice Band", "Choice Specs", "Eviolite", "Expert Belt", "Life Orb",
+    "Muscle Band", "Wise Glasses",
+])
+
+
+_gen_data_cache = None
+
+
+def _gen_data():
+    # poke-env is only imported on the first query
+    global _gen_data_cache
+    if _gen_data_cache is None:
+        from poke_env.data import GenData
+
+        _gen_data_cache = GenData.from_gen(GEN)
+    return _gen_data_cache
+
+
+# display name -> poke-env entry (None when unknown), memoized as the same few hundred
+# names come back on every turn
+_species_by_name: Dict[str, Optional[Dict[str, Any]]] = {}
+_moves_by_name: Dict[str, Optional[Dict[str, Any]]] = {}
+
+
+def _species(name: str) -> Optional[Dict[str, Any]]:
+    try:
+        return _species_by_name[name]
+    except KeyError:
+        species = _gen_data().pokedex.get(to_id(name))
+        if species is not None and species.get("isNonstandard"):
+            species = None
+        _species_by_name[name] = species
+        return species
+
+
+def _move(name: str) -> Optional[Dict[str, Any]]:
+    try:
+        return _moves_by_name[name]
+    except KeyError:
+        move = _gen_data().moves.get(to_id(name))
+        if move is not None and (move.get("isNonstandard") or to_id(name) in SPECIAL_MOVES):
+            move = None
+        _moves_by_name[name] = move
+        return move
+
+
+def unsupported_reason(calc_input: list) -> Optional[str]:
+    # Why `calc_input` has to go to @smogon/calc, or None when calculate handles it
+    attacker_name, attacker_attributes, defender_name, defender_attributes, move_name = calc_input
+    move = _move(move_name)
+    if move is None:
+        return f"move:{move_name}"
+    status = move["category"] == "Status"
+    for name, attributes in ((attacker_name, attacker_attributes), (defender_name, defender_attributes)):
+        species = _species(name)
+        if species is None:
+            return f"species:{name}"
+        if status:
+            continue
+        ability = species["abilities"].get("0", "")
+        if ability not in HANDLED_ABILITIES:
+            return f"ability:{ability}"
+        item = attributes.get("item") or ""
+        if item not in HANDLED_ITEMS:
+            return f"item:{item}"
+        if attributes.get("teraType") == "Stellar":
+            return "tera:Stellar"
+    if not status and (move["basePower"] <= 0 or SPECIAL_MOVE_FIELDS.intersection(move)):
+        return f"move:{move['name']}"
+    return None
+
+
+def _stat(species: Dict[str, Any], attributes: Dict[str, Any], stat: str) -> int:
+    # @smogon/calc defaults: level 100, 31 IVs, 0 EVs and a neutral nature
+    base = species["baseStats"][stat]
+    level = attributes.get("level") or 100
+    iv = (attributes.get("ivs") or {}).get(stat, 31)
+    ev = (attributes.get("evs") or {}).get(stat, 0)
+    value = (2 * base + iv + ev // 4) * level // 100
+    if stat == "hp":
+        return 1 if base == 1 else value + level + 10
+    return value + 5
+
+
+def _boosted(stat: int, boost: int) -> int:
+    if boost >= 0:
+        return stat * (2 + boost) // 2
+    return stat * 2 // (2 - boost)
+
+
+def _chain_mods(mods: List[int], lower: int, upper: int) -> int:
+    modifier = 4096
+    for mod in mods:
+        if mod != 4096:
+            modifier = (modifier * mod + 2048) >> 12
+    return max(min(modifier, upper), lower)
+
+
+def _apply_mod(value: int, mod: int) -> int:
+    # value * mod / 4096, rounded like the games (halves down), in integers
+    quotient, remainder = divmod(value * mod, 4096)
+    return quotient + 1 if remainder > 2048 else quotient
+
+
+def _of16(value: int) -> int:
+    return value % 65536 if value > 65535 else value
+
+
+def calculate(calc_input: list) -> Optional[Dict[str, Any]]:
+    """The @smogon/calc result for `calc_input`, or None when it needs the JS calc
+    (see unsupported_reason)."""
+    if unsupported_reason(calc_input) is not None:
+        return None
+    attacker_name, attacker_attributes, defender_name, defender_attributes, move_name = calc_input
+    move = _move(move_name)
+    attacker, defender = _species(attacker_name), _species(defender_name)
+    result = {"damage": 0, "originalCurHP": _stat(defender, defender_attributes, "hp")}
+    if move["category"] == "Status":
+        return result
+
+    # effectiveness in quarters: 0, 1, 2, 4, 8 or 16
+    type_chart = _gen_data().type_chart
+    move_type = move["type"]
+    attacker_tera = attacker_attributes.get("teraType") or ""
+    defender_tera = defender_attributes.get("teraType") or ""
+    effectiveness = 4
+    for defender_type in [defender_tera] if defender_tera else defender["types"]:
+        effectiveness = int(effectiveness * type_chart[defender_type.upper()][move_type.upper()])
+    defender_ability = defender["abilities"].get("0", "")
+    if effectiveness == 0 or IMMUNITY_ABILITIES.get(defender_ability) == move_type:
+        return result
+    if move["priority"] > 0 and defender_ability in PRIORITY_IMMUNITY_ABILITIES:
+        return result
+
+    physical = move["category"] == "Physical"
+    attacker_ability = attacker["abilities"].get("0", "")
+    attacker_item = attacker_attributes.get("item") or ""
+    defender_item = defender_attributes.get("item") or ""
+
+    bp_mods = []
+    if TYPE_BOOST_ITEMS.get(attacker_item) == move_type:
+        bp_mods.append(4915)
+    elif attacker_item == ("Muscle Band" if physical else "Wise Glasses"):
+        bp_mods.append(4505)
+    base_power = _of16(max(1, _apply_mod(move["basePower"], _chain_mods(bp_mods, 41, 2097152))))
+    if attacker_tera == move_type and move["priority"] <= 0 and base_power < 60:
+        base_power = 60
+
+    attack_stat = "atk" if physical else "spa"
+    attack = _boosted(_stat(attacker, attacker_attributes, attack_stat), (attacker_attributes.get("boosts") or {}).get(attack_stat, 0))
+    at_mods = []
+    if physical and attacker_ability in ("Huge Power", "Pure Power"):
+        at_mods.append(8192)
+    if defender_ability == "Thick Fat" and move_type in ("Fire", "Ice"):
+        at_mods.append(2048)
+    if attacker_item == ("Choice Band" if physical else "Choice Specs"):
+        at_mods.append(6144)
+    attack = _of16(max(1, _apply_mod(attack, _chain_mods(at_mods, 410, 131072))))
+
+    defense_stat = "def" if physical else "spd"
+    defense = _boosted(_stat(defender, defender_attributes, defense_stat), (defender_attributes.get("boosts") or {}).get(defense_stat, 0))
+    df_mods = []
+    if (defender_item == "Eviolite" and _not_fully_evolved(defender)) or (not physical and defender_item == "Assault Vest"):
+        df_mods.append(6144)
+    defense = _of16(max(1, _apply_mod(defense, _chain_mods(df_mods, 410, 131072))))
+
+    level = attacker_attributes.get("level") or 100
+    base_damage = (2 * level // 5 + 2) * base_power * attack // defense // 50 + 2
+
+    stab_mod = 4096
+    if move_type in attacker["types"]:
+        stab_mod += 2048
+    if attacker_tera == move_type:
+        stab_mod += 2048
+    final_mods = []
+    if attacker_item == "Expert Belt" and effectiveness > 4:
+        final_mods.append(4915)
+    elif attacker_item == "Life Orb":
+        final_mods.append(5324)
+    final_mod = _chain_mods(final_mods, 41, 131072)
+
+    # the 16 random rolls (85% to 100%), each through STAB, effectiveness and the final modifier
+    damage = []
+    for roll in range(85, 101):
+        amount = _apply_mod(base_damage * roll // 100, stab_mod) * effectiveness // 4
+        damage.append(_of16(_apply_mod(amount, final_mod)) if amount * final_mod >= 4096 else 1)
+    result["damage"] = damage
+    return result
+
+
+def _not_fully_evolved(species: Dict[str, Any]) -> bool:
+    # what @smogon/calc calls nfe: an evolution that exists in gen 9
+    return any(_species(evo) is not None for evo in species.get("evos", []))
+
+
+def iter_corpus_queries(input_path: str, battles: int) -> Iterator[Tuple[str, list, bool]]:
+    # (battle_id, calc input, opponent) of every damage query prompt generation makes on the corpus
+    from battle_simulator import iter_battles
+    from damage_engine import _calc_attributes
+    from produce_question_prompts import find_potential_random_set, get_team_data
+    from random_sets import RandomSetResolver, get_random_set_index
+    from replay_store import iter_battle_logs
+
+    def logs():
+        for i, row in enumerate(iter_battle_logs(input_path)):
+            if i == battles:
+                break
+            yield row["battle_id"], row["log_content"]
+
+    resolver = None
+    for record in iter_battles(logs()):
+        if record.done:
+            resolver = None
+            continue
+        if resolver is None:
+            resolver = RandomSetResolver(get_random_set_index())
+        simulator = record.simulator
+        if simulator.active_pokemon is None or simulator.opponent_active_pokemon is None:
+            continue
+        player = get_team_data(simulator)[simulator.active_pokemon.species]
+        opponent = find_potential_random_set(get_team_data(simulator, opponent=True), resolver)[simulator.opponent_active_pokemon.species]
+        for atkr, defdr, pokemon, opponent_side in (
+            (player, opponent, simulator.active_pokemon, True),
+            (opponent, player, simulator.opponent_active_pokemon, False),
+        ):
+            for move in pokemon.moves:
+                calc_input = [atkr.get("name"), _calc_attributes(atkr), defdr.get("name"), _calc_attributes(defdr), move]
+                yield record.battle_id, calc_input, opponent_side
+
+
+def compare_with_js(input_path: str, battles: int, batch_size: int = 500, examples: int = 5) -> Dict[str, Any]:
+    """Runs every natively supported query of the first `battles` battles through both calcs.
+
+    Returns the coverage (supported share of the queries and the most common reasons the
+    others are not) and every mismatch between the damage rolls, grouped by move.
+    """
+    from damage_engine import DamageEngine
+
+    calculator = DamageEngine()._get_calculator()
+    total = 0
+    reasons: Counter = Counter()
+    mismatches: Dict[str, List[Dict[str, Any]]] = {}
+    mismatch_count = compared = 0
+    batch: List[Tuple[str, list, Dict[str, Any]]] = []
+
+    def flush():
+        nonlocal mismatch_count, compared
+        expected = json.loads(calculator.calculateBatch(json.dumps([calc_input for _, calc_input, _ in batch])))
+        for (battle_id, calc_input, native), js in zip(batch, expected):
+            compared += 1
+            if "error" in js or js["damage"] != native["damage"] or js["originalCurHP"] != native["originalCurHP"]:
+                mismatch_count += 1
+                found = mismatches.setdefault(str(calc_input[4]), [])
+                if len(found) < examples:
+                    found.append({"battle_id": battle_id, "input": calc_input, "native": native, "js": js})
+        batch.clear()
+
+    for battle_id, calc_input, _ in iter_corpus_queries(input_path, battles):
+        total += 1
+        reason = unsupported_reason(calc_input)
+        if reason is not None:
+            reasons[reason] += 1
+            continue
+        batch.append((battle_id, calc_input, calculate(calc_input)))
+        if len(batch) == batch_size:
+            flush()
+    if batch:
+        flush()
+
+    return {
+        "queries": total,
+        "native": compared,
+        "native_share": compared / total if total else 0.0,
+        "mismatches": mismatch_count,
+        "unsupported": dict(reasons.most_common(30)),
+        "mismatch_examples": mismatches,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the native damage calc with @smogon/calc over a corpus")
+    # a battle_logs parquet file or a replay store directory
+    parser.add_argument("--input", default="data/battle_logs.parquet")
+    parser.add_argument("--battles", type=int, default=500)
+    parser.add_argument("--report", help="Also write the full comparison as JSON")
+    args = parser.parse_args()
+
+    report = compare_with_js(args.input, args.battles)
+    print(f"{report['native']} of {report['queries']} queries ({report['native_share']:.1%}) handled natively, "
+          f"{report['mismatches']} mismatches with @smogon/calc")
+    for move, found in sorted(report["mismatch_examples"].items(), key=lambda item: -len(item[1])):
+        print(f"  {move}: e.g. {found[0]['input']}")
+    print("Most common reasons for the JS calc:", ", ".join(f"{reason} ({count})" for reason, count in list(report["unsupported"].items())[:10]))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    raise SystemExit(1 if report["mismatches"] else 0)
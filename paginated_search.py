@@ -1,35 +1,159 @@
-import requests, json
-from typing import List, Dict, Union
-base_url = "https://replay.pokemonshowdown.com/api/replays/search?format=gen9randombattle&page=[PAGE_NUMBER]&sort=rating"
+from typing import Dict, Iterable, List, Optional, Set, Union
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import json
+import os
+
+import requests
+
+from grab_battle_logs import RateLimiter, make_session
+
+BASE_URL = "https://replay.pokemonshowdown.com"
+SEARCH_PATH = "/api/replays/search"
 """
 Sample response:
 ][{"uploadtime":1719792149,"id":"gen9randombattle-2152949532","format":"[Gen 9] Random Battle","players":["MichaelderBeste2","drifttrick"],"rating":2547,"private":0,"password":null},{"uploadtime":1712684694,"id":"gen9randombattle-2099652333","format":"[Gen 9] Random Battle","players":["MichaelderBeste2","pokeblade☆101"],"rating":2547,"private":0,"password":null},{"uploadtime":1720261993,"id":"gen9randombattle-2156077866","format":"[Gen 9] Random Battle","players":["Referrals","MichaelderBeste2"],"rating":2533,"private":0,"password":null},{"uploadtime":1716305743,"id":"gen9randombattle-2127525323","format":"[Gen 9] Random Battle","players":["ye im very bad","MichaelderBeste2"],"rating":2532,"private":0,"password":null},{"uploadtime":1714168022,"id":"gen9randombattle-2112313608","format":"[Gen 9] Random Battle","players":["Aqua","Delta 2777"],"rating":2528,"private":0,"password":null},{"uploadtime":1714576645,"id":"gen9randombattle-2115561264","format":"[Gen 9] Random Battle","players":["MichaelderBeste2","pokeblade☆101"],"rating":2525,"private":0,"password":null},{"uploadtime":1716223727,"id":"gen9randombattle-2126856728","format":"[Gen 9] Random Battle","players":["ye im very bad","MichaelderBeste2"],"rating":2514,"private":0,"password":null},{"uploadtime":1713922569,"id":"gen9randombattle-2110208528","format":"[Gen 9] Random Battle","players":["pokeblade☆101","Lucius Artor"],"rating":2511,"private":0,"password":null},{"uploadtime":1713918222,"id":"gen9randombattle-2110174164","format":"[Gen 9] Random Battle","players":["pokeblade☆101","Lucius Artor"],"rating":2506,"private":0,"password":null},{"uploadtime":1715108941,"id":"gen9randombattle-2119905168","format":"[Gen 9] Random Battle","players":["Delta 2777","MichaelderBeste2"],"rating":2502,"private":0,"password":null},{"uploadtime":1713122307,"id":"gen9randombattle-2103376120","format":"[Gen 9] Random Battle","players":["Norman2!","pokeblade☆101"],"rating":2493,"private":0,"password":null},{"uploadtime":1713879269,"id":"gen9randombattle-2109745420","format":"[Gen 9] Random Battle","players":["Aqua","Delta 2777"],"rating":2492,"private":0,"password":null},{"uploadtime":1716842907,"id":"gen9randombattle-2131700216","format":"[Gen 9] Random Battle","players":["MichaelderBeste2","Delta 2777"],"rating":2489,"private":0,"password":null},{"uploadtime":1713520593,"id":"gen9randombattle-2106881006","format":"[Gen 9] Random Battle","players":["Boris Huang - YT","MichaelderBeste2"],"rating":2483,"private":0,"password":null},{"uploadtime":1721663036,"id":"gen9randombattle-2165415712","format":"[Gen 9] Random Battle","players":["Referrals","kandkad"],"rating":2482,"private":0,"password":null},{"uploadtime":1722903990,"id":"gen9randombattle-2174283453","format":"[Gen 9] Random Battle","players":["kandkad","HaunterBoy28"],"rating":2479,"private":0,"password":null},{"uploadtime":1725803985,"id":"gen9randombattle-2197139572","format":"[Gen 9] Random Battle","players":["paysa","lt111vz mdb2"],"rating":2478,"private":0,"password":null},{"uploadtime":1722979196,"id":"gen9randombattle-2174873559","format":"[Gen 9] Random Battle","players":["ezws","kandkad"],"rating":2476,"private":0,"password":null},{"uploadtime":1714356814,"id":"gen9randombattle-2113726288","format":"[Gen 9] Random Battle","players":["freezai","pokeblade☆101"],"rating":2475,"private":0,"password":null},{"uploadtime":1714156277,"id":"gen9randombattle-2112206530","format":"[Gen 9] Random Battle","players":["LT_Alt1","Aqua"],"rating":2471,"private":0,"password":null},{"uploadtime":1714948332,"id":"gen9randombattle-2118556577","format":"[Gen 9] Random Battle","players":["Delta 2777","pokeblade☆101"],"rating":2470,"private":0,"password":null},{"uploadtime":1714318722,"id":"gen9randombattle-2113384636","format":"[Gen 9] Random Battle","players":["pokeblade☆101","MichaelderBeste2"],"rating":2470,"private":0,"password":null},{"uploadtime":1725182055,"id":"gen9randombattle-2192220691","format":"[Gen 9] Random Battle","players":["Soren-sage","MichaelderBesteVGC"],"rating":2469,"private":0,"password":null},{"uploadtime":1722906242,"id":"gen9randombattle-2174303998","format":"[Gen 9] Random Battle","players":["Referrals","HaunterBoy28"],"rating":2469,"private":0,"password":null},{"uploadtime":1724608994,"id":"gen9randombattle-2187585455","format":"[Gen 9] Random Battle","players":["drifttrick","Teres bahji"],"rating":2466,"private":0,"password":null},{"uploadtime":1711503593,"id":"gen9randombattle-2089946975","format":"[Gen 9] Random Battle","players":["Referrals","MichaelderBeste2"],"rating":2465,"private":0,"password":null},{"uploadtime":1716498079,"id":"gen9randombattle-2129157490","format":"[Gen 9] Random Battle","players":["MichaelderBeste2","Delta 2777"],"rating":2464,"private":0,"password":null},{"uploadtime":1712786481,"id":"gen9randombattle-2100604806","format":"[Gen 9] Random Battle","players":["MichaelderBeste2","Referrals"],"rating":2464,"private":0,"password":null},{"uploadtime":1714946943,"id":"gen9randombattle-2118545428","format":"[Gen 9] Random Battle","players":["pokeblade☆101","Delta 2777"],"rating":2463,"private":0,"password":null},{"uploadtime":1713073764,"id":"gen9randombattle-2103028339","format":"[Gen 9] Random Battle","players":["Referrals","LT_Alt1"],"rating":2463,"private":0,"password":null},{"uploadtime":1713297685,"id":"gen9randombattle-2104939986","format":"[Gen 9] Random Battle","players":["MichaelderBeste2","Teres bahji"],"rating":2462,"private":0,"password":null},{"uploadtime":1714351452,"id":"gen9randombattle-2113679483","format":"[Gen 9] Random Battle","players":["pokeblade☆101","MichaelderBeste2"],"rating":2460,"private":0,"password":null},{"uploadtime":1713718149,"id":"gen9randombattle-2108424504","format":"[Gen 9] Random Battle","players":["Aqua","BillyFan302"],"rating":2459,"private":0,"password":null},{"uploadtime":1718140318,"id":"gen9randombattle-2141473809","format":"[Gen 9] Random Battle","players":["MasterJ007","ceru➷edge➹"],"rating":2458,"private":0,"password":null},{"uploadtime":1722977810,"id":"gen9randombattle-2174863944","format":"[Gen 9] Random Battle","players":["kandkad","ezws"],"rating":2457,"private":0,"password":null},{"uploadtime":1722894083,"id":"gen9randombattle-2174199330","format":"[Gen 9] Random Battle","players":["kandkad","ezws"],"rating":2457,"private":0,"password":null},{"uploadtime":1714278428,"id":"gen9randombattle-2113141898","format":"[Gen 9] Random Battle","players":["freezai","LT_Alt1"],"rating":2455,"private":0,"password":null},{"uploadtime":1720632853,"id":"gen9randombattle-2158561491","format":"[Gen 9] Random Battle","players":["Pedrocini","Referrals"],"rating":2453,"private":0,"password":null},{"uploadtime":1716497004,"id":"gen9randombattle-2129151602","format":"[Gen 9] Random Battle","players":["Teres bahji","Delta 2777"],"rating":2452,"private":0,"password":null},{"uploadtime":1725555626,"id":"gen9randombattle-2195206358","format":"[Gen 9] Random Battle","players":["Teres bahji","MichaelderBesteVGC"],"rating":2450,"private":0,"password":null},{"uploadtime":1718282677,"id":"gen9randombattle-2142489462","format":"[Gen 9] Random Battle","players":["ceru-edge","PTKmoekyuun"],"rating":2449,"private":0,"password":null},{"uploadtime":1713087440,"id":"gen9randombattle-2103100982","format":"[Gen 9] Random Battle","players":["Lucius artor","MichaelderBeste2"],"rating":2449,"private":0,"password":null},{"uploadtime":1720261147,"id":"gen9randombattle-2156071840","format":"[Gen 9] Random Battle","players":["JustOut459","MichaelderBeste2"],"rating":2448,"private":0,"password":null},{"uploadtime":1722910437,"id":"gen9randombattle-2174342954","format":"[Gen 9] Random Battle","players":["ball enthusiast","Referrals"],"rating":2447,"private":0,"password":null},{"uploadtime":1722861554,"id":"gen9randombattle-2173893103","format":"[Gen 9] Random Battle","players":["Delta 2777","cacahue"],"rating":2447,"private":0,"password":null},{"uploadtime":1717010966,"id":"gen9randombattle-2133050475","format":"[Gen 9] Random Battle","players":["ye im very bad","Sylveon is so cute"],"rating":2447,"private":0,"password":null},{"uploadtime":1719349561,"id":"gen9randombattle-2149997026","format":"[Gen 9] Random Battle","players":["Petros","Michielleus"],"rating":2446,"private":0,"password":null},{"uploadtime":1723143284,"id":"gen9randombattle-2176173110","format":"[Gen 9] Random Battle","players":["PTKmoekyuun","xceloh"],"rating":2445,"private":0,"password":null},{"uploadtime":1721502711,"id":"gen9randombattle-2164402413","format":"[Gen 9] Random Battle","players":["Batram","teres bahji"],"rating":2444,"private":0,"password":null},{"uploadtime":1713428279,"id":"gen9randombattle-2106071475","format":"[Gen 9] Random Battle","players":["Referrals","soTsoT"],"rating":2444,"private":0,"password":null},{"uploadtime":1725387110,"id":"gen9randombattle-2193837014","format":"[Gen 9] Random Battle","players":["MichaelderBesteVGC","Delta 2777"],"rating":2443,"private":0,"password":null}]
 """
 
+Replay = Dict[str, Union[str, int]]
+
+
 # Just want the id of the replay
-def get_replays(page_number: int) -> List[Dict[str, Union[str, int]]]:
-    url = base_url.replace("[PAGE_NUMBER]", str(page_number))
-    response = requests.get(url)
-    data = response.text[1:]
-
-    data = json.loads(data)
-    return [{"rating": replay['rating'], "id": replay['id']} for replay in data]
-
-# keep grabbing pages until we get a replay with a rating less than 1800
-replays = []
-page_number = 1
-continue_loop = True
-while continue_loop:
-    new_replays = get_replays(page_number)
-    replays.extend(new_replays)
-    rating = replays[-1]["rating"]
-    if rating < 2200 or len(new_replays) == 0:
-        continue_loop = False
-    page_number += 1
-    print(f"Grabbed page {page_number} now with {len(replays)} replays total with rating {rating}")
-
-print(f"Found {len(replays)} replays with rating >= 2200")
-with open('data/replays.jsonl', 'w') as outfile:
-    for entry in replays:
-        json.dump(entry, outfile)
-        outfile.write('\n')
\ No newline at end of file
+def get_replays(
+    session: requests.Session,
+    page_number: int,
+    base_url: str = BASE_URL,
+    battle_format: str = "gen9randombattle",
+    sort: Optional[str] = "rating",
+) -> List[Replay]:
+    # One page of the search, best rated first, or most recently uploaded first when sort is None
+    params: Dict[str, Union[str, int]] = {"format": battle_format, "page": page_number}
+    if sort is not None:
+        params["sort"] = sort
+    response = session.get(base_url + SEARCH_PATH, params=params, timeout=30)
+    response.raise_for_status()
+    # the response is prefixed with "]" to keep it from being evaluated as a script
+    data = json.loads(response.text[1:])
+    return [
+        {"rating": replay["rating"] or 0, "id": replay["id"], "uploadtime": replay["uploadtime"]}
+        for replay in data
+    ]
+
+
+def read_state(path: str) -> Dict[str, int]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_state(path: str, state: Dict[str, int]) -> None:
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def read_replay_ids(path: str) -> Set[str]:
+    ids: Set[str] = set()
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                ids.add(json.loads(line)["id"])
+    return ids
+
+
+def iter_page_windows(
+    session: requests.Session,
+    executor: ThreadPoolExecutor,
+    limiter: RateLimiter,
+    workers: int,
+    **search,
+) -> Iterable[List[Replay]]:
+    # Pages in order, fetched `workers` at a time; the caller stops the crawl by breaking out
+    def fetch(page: int) -> List[Replay]:
+        limiter.wait()
+        return get_replays(session, page, **search)
+
+    page_number = 1
+    while True:
+        yield from executor.map(fetch, range(page_number, page_number + workers))
+        page_number += workers
+
+
+def crawl_replays(
+    output_path: str,
+    state_path: str,
+    base_url: str = BASE_URL,
+    battle_format: str = "gen9randombattle",
+    min_rating: int = 2200,
+    workers: int = 4,
+    rate: float = 5.0,
+    full: bool = False,
+) -> int:
+    """Appends the replays rated at least `min_rating` that are not in `output_path` yet.
+
+    The first crawl walks the search sorted by rating until a page holds a replay below
+    `min_rating`. It records the newest upload time it saw in `state_path`, and later
+    crawls walk the search by upload time instead, newest first, only back to that time.
+    Pages are fetched `workers` at a time and replays are deduplicated by id, so pages
+    that shift while the crawl runs do not add duplicates. Returns the number of replays
+    appended.
+    """
+    state = read_state(state_path)
+    seen = read_replay_ids(output_path)
+    # an earlier crawl with a higher minimum rating did not look at the replays in between
+    incremental = not full and state.get("max_uploadtime", 0) > 0 and state.get("min_rating", min_rating) <= min_rating
+    since = state["max_uploadtime"] if incremental else None
+
+    session = make_session(workers)
+    limiter = RateLimiter(rate)
+    max_uploadtime = state.get("max_uploadtime", 0)
+    added = pages = 0
+    with open(output_path, "a", encoding="utf-8") as outfile, ThreadPoolExecutor(workers) as executor:
+        for page in iter_page_windows(
+            session, executor, limiter, workers,
+            base_url=base_url, battle_format=battle_format, sort=None if incremental else "rating",
+        ):
+            pages += 1
+            for replay in page:
+                if replay["rating"] < min_rating or replay["id"] in seen:
+                    continue
+                if since is not None and replay["uploadtime"] < since:
+                    continue
+                seen.add(replay["id"])
+                max_uploadtime = max(max_uploadtime, replay["uploadtime"])
+                json.dump({"rating": replay["rating"], "id": replay["id"]}, outfile)
+                outfile.write('\n')
+                added += 1
+            outfile.flush()
+            print(f"Grabbed page {pages} now with {added} new replays")
+            if not page:
+                break
+            if since is None and min(replay["rating"] for replay in page) < min_rating:
+                break
+            if since is not None and min(replay["uploadtime"] for replay in page) < since:
+                break
+
+    # only a finished crawl moves the state forward; an interrupted one is redone and deduplicated
+    write_state(state_path, {"max_uploadtime": max_uploadtime, "min_rating": min_rating})
+    return added
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Append new highly rated replays to the replay list")
+    parser.add_argument("--output", default="data/replays.jsonl")
+    parser.add_argument("--state", default="data/replays_state.json")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--format", default="gen9randombattle")
+    parser.add_argument("--min-rating", type=int, default=2200)
+    parser.add_argument("--workers", type=int, default=4, help="Search pages fetched at a time")
+    parser.add_argument("--rate", type=float, default=5.0, help="Maximum requests per second")
+    parser.add_argument("--full", action="store_true", help="Walk every page rated at least --min-rating again")
+    args = parser.parse_args()
+
+    added = crawl_replays(
+        args.output, args.state,
+        base_url=args.base_url, battle_format=args.format, min_rating=args.min_rating,
+        workers=args.workers, rate=args.rate, full=args.full,
+    )
+    print(f"Found {added} new replays with rating >= {args.min_rating}")
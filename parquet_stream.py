@@ -0,0 +1,121 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+class StreamingParquetWriter:
+    """Writes rows to a parquet file one row group at a time.
+
+    At most `row_group_size` rows are held in memory; each full buffer is flushed as
+    its own row group. The file is written under a temporary name and only moved to
+    `path` on close, so a reader never sees a half-written file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        schema: pa.Schema,
+        row_group_size: int = 1000,
+        metadata: Optional[Dict[str, str]] = None,
+    ):
+        if metadata:
+            schema = schema.with_metadata({**(schema.metadata or {}), **metadata})
+        self.path = path
+        self.schema = schema
+        self.row_group_size = row_group_size
+        self.rows_written = 0
+        self._rows: List[Dict[str, Any]] = []
+        self._tmp_path = path + ".tmp"
+        self._writer = pq.ParquetWriter(self._tmp_path, schema)
+
+    def __enter__(self) -> "StreamingParquetWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_row(self, row: Dict[str, Any]) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self.flush()
+
+    def write_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        for row in rows:
+            self.write_row(row)
+
+    def write_batch(self, batch: Union[pa.RecordBatch, pa.Table]) -> None:
+        self.flush()
+        table = batch if isinstance(batch, pa.Table) else pa.Table.from_batches([batch])
+        self._writer.write_table(table.cast(self.schema), row_group_size=self.row_group_size)
+        self.rows_written += table.num_rows
+
+    def flush(self) -> None:
+        if not self._rows:
+            return
+        self._writer.write_table(pa.Table.from_pylist(self._rows, schema=self.schema))
+        self.rows_written += len(self._rows)
+        self._rows = []
+
+    def close(self) -> None:
+        self.flush()
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        self._writer.close()
+        os.remove(self._tmp_path)
+
+
+def parquet_files(path: str) -> List[str]:
+    # A parquet "path" is either a single file or a directory of files written one by one
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path) if name.endswith(".parquet")
+        )
+    return [path]
+
+
+def parquet_num_rows(path: str) -> int:
+    return sum(pq.ParquetFile(file).metadata.num_rows for file in parquet_files(path))
+
+
+def parquet_schema(path: str) -> pa.Schema:
+    return pq.ParquetFile(parquet_files(path)[0]).schema_arrow
+
+
+def iter_parquet_batches(
+    path: str, columns: Optional[List[str]] = None, batch_size: int = 1000
+) -> Iterator[pa.RecordBatch]:
+    """Yields record batches of at most `batch_size` rows from a parquet file or directory.
+
+    Only one batch is materialized at a time. A directory is read file by file, so the
+    completed files of an output that is still being produced can already be consumed.
+    """
+    for file in parquet_files(path):
+        yield from pq.ParquetFile(file).iter_batches(batch_size=batch_size, columns=columns)
+
+
+def iter_parquet_rows(
+    path: str, columns: Optional[List[str]] = None, batch_size: int = 1000
+) -> Iterator[Dict[str, Any]]:
+    for batch in iter_parquet_batches(path, columns=columns, batch_size=batch_size):
+        yield from batch.to_pylist()
+
+
+def concat_parquet(paths: List[str], output: str, row_group_size: int = 1000, schema: Optional[pa.Schema] = None) -> int:
+    # Streams several parquet files with the same schema into one, a row group at a time.
+    # Without paths, `schema` is needed to write the empty file.
+    if schema is None:
+        if not paths:
+            raise ValueError("concat_parquet needs a schema when there are no files to concatenate")
+        schema = parquet_schema(paths[0])
+    with StreamingParquetWriter(output, schema, row_group_size=row_group_size) as writer:
+        for path in paths:
+            for batch in iter_parquet_batches(path, batch_size=row_group_size):
+                writer.write_batch(batch)
+    return writer.rows_written
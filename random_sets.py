@@ -0,0 +1,142 @@
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from datetime import datetime, timezone
+import argparse
+import hashlib
+import json
+import os
+
+from lookup_tables import DATA_DIR
+
+RANDOM_SETS_URL = "https://pkmn.github.io/randbats/data/gen9randombattle.json"
+RANDOM_SETS_PATH = os.path.join(DATA_DIR, "gen9randombattle.json")
+
+
+def fetch_random_sets(path: str = RANDOM_SETS_PATH, url: str = RANDOM_SETS_URL) -> Dict[str, Any]:
+    """Downloads the randbats sets and caches them at `path` with a version stamp.
+
+    The stamp records where and when the data was fetched, the server's ETag and the
+    sha256 of the payload. When a cached copy exists its ETag is sent along, so an
+    unchanged upstream file is not downloaded again.
+    """
+    import requests
+
+    cached = _read_cache(path)
+    headers = {}
+    if cached is not None and cached["version"].get("etag"):
+        headers["If-None-Match"] = cached["version"]["etag"]
+    response = requests.get(url, headers=headers, timeout=30)
+    if response.status_code == 304 and cached is not None:
+        return cached["sets"]
+    response.raise_for_status()
+
+    version = {
+        "url": url,
+        "fetched_at": datetime.now(timezone.utc).isoformat(),
+        "etag": response.headers.get("ETag"),
+        "sha256": hashlib.sha256(response.content).hexdigest(),
+    }
+    sets = response.json()
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": version, "sets": sets}, f)
+    os.replace(path + ".tmp", path)
+    return sets
+
+
+def _read_cache(path: str) -> Optional[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_random_sets(path: str = RANDOM_SETS_PATH) -> Dict[str, Any]:
+    # Use the local copy when there is one; only go to the network the first time
+    cached = _read_cache(path)
+    if cached is not None:
+        return cached["sets"]
+    return fetch_random_sets(path)
+
+
+def random_sets_version(path: str = RANDOM_SETS_PATH) -> Optional[Dict[str, Any]]:
+    cached = _read_cache(path)
+    return cached["version"] if cached is not None else None
+
+
+class RandomSetIndex:
+    """Per-species index of the randbats roles.
+
+    Each role of a species gets one bit, and every move maps to the bitmask of the roles
+    that run it. The roles compatible with a set of known moves are the AND of those
+    masks, and the first compatible role is the lowest set bit, which is the role a
+    linear scan in file order would have picked.
+    """
+
+    def __init__(self, random_sets: Dict[str, Any]):
+        self._species: Dict[str, Tuple[List[Dict[str, Any]], Dict[str, int], int]] = {}
+        for species, data in random_sets.items():
+            roles = list(data.get("roles", {}).values())
+            move_masks: Dict[str, int] = {}
+            for i, role in enumerate(roles):
+                for move in role["moves"]:
+                    move_masks[move] = move_masks.get(move, 0) | (1 << i)
+            self._species[species] = (roles, move_masks, (1 << len(roles)) - 1)
+
+    def __contains__(self, species: str) -> bool:
+        return species in self._species
+
+    def candidate_mask(self, species: str, known_moves: FrozenSet[str], mask: Optional[int] = None) -> int:
+        # narrow `mask` (all roles by default) down to the roles that run every move in known_moves
+        roles, move_masks, all_roles = self._species[species]
+        if mask is None:
+            mask = all_roles
+        for move in known_moves:
+            mask &= move_masks.get(move, 0)
+            if not mask:
+                break
+        return mask
+
+    def role(self, species: str, mask: int) -> Optional[Dict[str, Any]]:
+        if not mask:
+            return None
+        return self._species[species][0][(mask & -mask).bit_length() - 1]
+
+
+class RandomSetResolver:
+    """Infers the randbats role of the opponent's pokemon over the course of one battle.
+
+    Known moves only grow during a battle, so the candidate roles of a pokemon are
+    narrowed by the newly revealed moves only, rather than re-checked from scratch.
+    """
+
+    def __init__(self, index: RandomSetIndex):
+        self.index = index
+        self._state: Dict[Tuple[str, str], Tuple[FrozenSet[str], int]] = {}
+
+    def role(self, pokemon: str, species: str, known_moves: FrozenSet[str]) -> Optional[Dict[str, Any]]:
+        previous = self._state.get((pokemon, species))
+        if previous is not None and previous[0] == known_moves:
+            mask = previous[1]
+        elif previous is not None and previous[0] <= known_moves:
+            mask = self.index.candidate_mask(species, known_moves - previous[0], previous[1])
+        else:
+            mask = self.index.candidate_mask(species, known_moves)
+        self._state[(pokemon, species)] = (known_moves, mask)
+        return self.index.role(species, mask)
+
+
+_random_set_index: Optional[RandomSetIndex] = None
+
+
+def get_random_set_index() -> RandomSetIndex:
+    global _random_set_index
+    if _random_set_index is None:
+        _random_set_index = RandomSetIndex(load_random_sets())
+    return _random_set_index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Refresh the local copy of the gen 9 randbats sets")
+    parser.add_argument("--path", default=RANDOM_SETS_PATH)
+    args = parser.parse_args()
+    fetch_random_sets(args.path)
+    print(f"Random sets at {args.path}: {random_sets_version(args.path)}")
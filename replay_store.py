@@ -0,0 +1,447 @@
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import zlib
+
+import numpy as np
+
+from lookup_tables import DATA_DIR
+
+REPLAY_STORE_PATH = os.path.join(DATA_DIR, "replay_store")
+BLOBS_FILE = "blobs.bin"
+INDEX_FILE = "index.json"
+DICTIONARY_FILE = "dictionary.zstd"
+STORE_VERSION = 1
+# zstd cannot train a dictionary on a handful of logs; smaller corpora are stored without one
+MIN_DICTIONARY_SAMPLES = 100
+# Index files, per generation: every close writes a new generation and then points
+# index.json at it, so a reader never sees a half-written index
+ENTRIES_FILE = "entries.{}.npy"
+IDS_FILE = "battle_ids.{}.bin"
+LOOKUP_FILE = "lookup.{}.npy"
+
+# (battle_id, rating, offset, compressed length, sha1 of the log) in insertion order
+IndexEntry = Tuple[str, int, int, int, str]
+
+# One fixed-width record per battle, in insertion order. The battle id is the
+# [id_offset, id_offset + id_length) slice of the ids file.
+ENTRY_DTYPE = np.dtype([
+    ("offset", "<u8"), ("length", "<u4"), ("rating", "<i8"),
+    ("id_offset", "<u8"), ("id_length", "<u4"), ("digest", "u1", (20,)),
+])
+# empty slot of the battle id lookup table
+EMPTY_SLOT = -1
+
+
+def _zstandard():
+    # zstandard is optional; without it stores are written with zlib and no dictionary
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def is_replay_store(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+def _read_index(directory: str) -> Dict[str, Any]:
+    with open(os.path.join(directory, INDEX_FILE), encoding="utf-8") as f:
+        index = json.load(f)
+    if index["version"] != STORE_VERSION:
+        raise ValueError(f"Replay store {directory} has version {index['version']}, expected {STORE_VERSION}")
+    return index
+
+
+def _id_hash(battle_id: bytes) -> int:
+    # stable across processes, unlike hash()
+    return int.from_bytes(hashlib.blake2b(battle_id, digest_size=8).digest(), "little")
+
+
+def _build_lookup(battle_ids: List[bytes]) -> np.ndarray:
+    # Open-addressing hash table from battle id to position, at most half full
+    size = 8
+    while size < 2 * len(battle_ids):
+        size *= 2
+    mask = size - 1
+    table = [EMPTY_SLOT] * size
+    for position, battle_id in enumerate(battle_ids):
+        slot = _id_hash(battle_id) & mask
+        while table[slot] != EMPTY_SLOT:
+            slot = (slot + 1) & mask
+        table[slot] = position
+    return np.array(table, dtype="<i8")
+
+
+def _map_file(f) -> Union[mmap.mmap, bytes]:
+    # an empty file cannot be mapped
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+
+class ReplayStore:
+    """Read-only view of a replay store directory.
+
+    Logs are compressed one by one into a single blobs.bin. The index is a fixed-width
+    array of (blob offset, length, rating, battle id slice) records, the concatenated
+    battle ids and a hash table from battle id to record; all of them are memory-mapped
+    along with the blobs, so opening a store reads nothing but index.json and reading one
+    battle decompresses that blob only. Battles whose logs are byte-identical share a
+    blob. An instance is not safe to share between threads or processes; open one each.
+    """
+
+    def __init__(self, directory: str = REPLAY_STORE_PATH):
+        self.directory = directory
+        index = _read_index(directory)
+        self.codec: str = index["codec"]
+        self._count: int = index["count"]
+        generation = index["generation"]
+        # an empty array cannot be memory-mapped
+        self._records = np.load(os.path.join(directory, ENTRIES_FILE.format(generation)), mmap_mode="r" if self._count else None)
+        self._lookup = np.load(os.path.join(directory, LOOKUP_FILE.format(generation)), mmap_mode="r")
+        self._decompress = self._make_decompressor(index.get("dictionary", False))
+
+        self._ids_file = open(os.path.join(directory, IDS_FILE.format(generation)), "rb")
+        self._ids = _map_file(self._ids_file)
+        self._file = open(os.path.join(directory, BLOBS_FILE), "rb")
+        self._blobs = _map_file(self._file)
+
+    def _make_decompressor(self, dictionary: bool):
+        if self.codec == "zlib":
+            return zlib.decompress
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise ImportError(f"Replay store {self.directory} is zstd-compressed; install zstandard to read it")
+        dict_data = None
+        if dictionary:
+            with open(os.path.join(self.directory, DICTIONARY_FILE), "rb") as f:
+                dict_data = zstandard.ZstdCompressionDict(f.read())
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, battle_id: str) -> bool:
+        return self._position(battle_id) is not None
+
+    def __enter__(self) -> "ReplayStore":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def battle_ids(self) -> List[str]:
+        return [self._battle_id(position).decode("utf-8") for position in range(self._count)]
+
+    def _battle_id(self, position: int) -> bytes:
+        record = self._records[position]
+        start = int(record["id_offset"])
+        return self._ids[start:start + int(record["id_length"])]
+
+    def _position(self, battle_id: str) -> Optional[int]:
+        key = battle_id.encode("utf-8")
+        mask = len(self._lookup) - 1
+        slot = _id_hash(key) & mask
+        while True:
+            position = int(self._lookup[slot])
+            if position == EMPTY_SLOT:
+                return None
+            if self._battle_id(position) == key:
+                return position
+            slot = (slot + 1) & mask
+
+    def _read(self, position: int) -> str:
+        record = self._records[position]
+        offset = int(record["offset"])
+        return self._decompress(self._blobs[offset:offset + int(record["length"])]).decode("utf-8")
+
+    def _row(self, position: int) -> Dict[str, Any]:
+        return {
+            "battle_id": self._battle_id(position).decode("utf-8"),
+            "rating": int(self._records[position]["rating"]),
+            "log_content": self._read(position),
+        }
+
+    def get(self, battle_id: str) -> str:
+        # raises KeyError for a battle that is not in the store
+        return self._read(self._checked_position(battle_id))
+
+    def get_row(self, position: int) -> Dict[str, Any]:
+        # the battle at `position` in insertion order, as a battle_logs.parquet row
+        if not -self._count <= position < self._count:
+            raise IndexError(position)
+        return self._row(position % self._count)
+
+    def iter_batches(self, batch_size: int = 1000, battle_ids: Optional[Iterable[str]] = None) -> Iterator[List[Dict[str, Any]]]:
+        """Yields lists of at most `batch_size` rows shaped like battle_logs.parquet rows.
+
+        Rows come in insertion order, or in the order of `battle_ids` when given. Only one
+        batch of logs is decompressed at a time.
+        """
+        if battle_ids is None:
+            positions: Iterable[int] = range(self._count)
+        else:
+            positions = (self._checked_position(battle_id) for battle_id in battle_ids)
+        batch: List[Dict[str, Any]] = []
+        for position in positions:
+            batch.append(self._row(position))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _checked_position(self, battle_id: str) -> int:
+        position = self._position(battle_id)
+        if position is None:
+            raise KeyError(battle_id)
+        return position
+
+    def iter_rows(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        for batch in self.iter_batches(batch_size):
+            yield from batch
+
+    def close(self) -> None:
+        # drop the memory-mapped arrays before their files' maps go away
+        self._records = self._lookup = None
+        for mapped in (self._blobs, self._ids):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+        self._file.close()
+        self._ids_file.close()
+
+
+def _read_entries(directory: str, index: Dict[str, Any]) -> List[IndexEntry]:
+    # every entry of an existing store, for a writer to add to
+    generation = index["generation"]
+    records = np.load(os.path.join(directory, ENTRIES_FILE.format(generation)))
+    with open(os.path.join(directory, IDS_FILE.format(generation)), "rb") as f:
+        ids = f.read()
+    return [
+        (ids[id_offset:id_offset + id_length].decode("utf-8"), rating, offset, length, bytes(digest).hex())
+        for offset, length, rating, id_offset, id_length, digest in records.tolist()
+    ]
+
+
+class ReplayStoreWriter:
+    """Adds battles to a replay store directory, creating it if needed.
+
+    Blobs are appended to blobs.bin as they are added and the index is written as a new
+    generation on close, with index.json replaced atomically last, so readers only ever
+    see complete battles; blobs left behind by a writer that did not close are cut off by
+    the next one. The codec and the zstd dictionary are fixed when the store is created.
+    """
+
+    def __init__(self, directory: str = REPLAY_STORE_PATH, dictionary: Optional[bytes] = None, level: int = 9, codec: Optional[str] = None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._generation = 0
+        if is_replay_store(directory):
+            index = _read_index(directory)
+            self.codec = index["codec"]
+            self._dictionary = index.get("dictionary", False)
+            self._generation = index["generation"]
+            entries = _read_entries(directory, index)
+        else:
+            self.codec = codec or ("zstd" if _zstandard() is not None else "zlib")
+            self._dictionary = dictionary is not None
+            if self._dictionary:
+                if self.codec != "zstd":
+                    raise ValueError("A compression dictionary needs the zstd codec")
+                with open(os.path.join(directory, DICTIONARY_FILE), "wb") as f:
+                    f.write(dictionary)
+            entries = []
+        self._entries: List[IndexEntry] = entries
+        self._positions = {entry[0]: i for i, entry in enumerate(entries)}
+        # content address -> (offset, length) of the blob already holding that log
+        self._blobs_by_digest = {entry[4]: (entry[2], entry[3]) for entry in entries}
+
+        end = max((offset + length for offset, length in self._blobs_by_digest.values()), default=0)
+        self._file = open(os.path.join(directory, BLOBS_FILE), "ab")
+        self._file.truncate(end)
+        self._offset = end
+        self._compress = self._make_compressor(level)
+
+    def _make_compressor(self, level: int):
+        if self.codec == "zlib":
+            return lambda data: zlib.compress(data, level)
+        zstandard = _zstandard()
+        if zstandard is None:
+            raise ImportError("Writing a zstd replay store needs zstandard")
+        dict_data = None
+        if self._dictionary:
+            with open(os.path.join(self.directory, DICTIONARY_FILE), "rb") as f:
+                dict_data = zstandard.ZstdCompressionDict(f.read())
+        return zstandard.ZstdCompressor(level=level, dict_data=dict_data).compress
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, battle_id: str) -> bool:
+        return battle_id in self._positions
+
+    def __enter__(self) -> "ReplayStoreWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def add(self, battle_id: str, rating: int, log_content: str) -> None:
+        # adding a battle id again replaces its log
+        data = log_content.encode("utf-8")
+        digest = hashlib.sha1(data).hexdigest()
+        blob = self._blobs_by_digest.get(digest)
+        if blob is None:
+            compressed = self._compress(data)
+            blob = self._blobs_by_digest[digest] = (self._offset, len(compressed))
+            self._file.write(compressed)
+            self._offset += len(compressed)
+        entry = (battle_id, rating, blob[0], blob[1], digest)
+        position = self._positions.get(battle_id)
+        if position is None:
+            self._positions[battle_id] = len(self._entries)
+            self._entries.append(entry)
+        else:
+            self._entries[position] = entry
+
+    def close(self) -> None:
+        self._file.close()
+        generation = self._generation + 1
+        battle_ids = [entry[0].encode("utf-8") for entry in self._entries]
+        records = np.zeros(len(self._entries), dtype=ENTRY_DTYPE)
+        if self._entries:
+            records["rating"] = [entry[1] for entry in self._entries]
+            records["offset"] = [entry[2] for entry in self._entries]
+            records["length"] = [entry[3] for entry in self._entries]
+            records["id_length"] = [len(battle_id) for battle_id in battle_ids]
+            records["id_offset"] = np.cumsum(records["id_length"], dtype="<u8") - records["id_length"]
+            records["digest"] = np.frombuffer(
+                b"".join(bytes.fromhex(entry[4]) for entry in self._entries), dtype="u1"
+            ).reshape(-1, 20)
+        np.save(os.path.join(self.directory, ENTRIES_FILE.format(generation)), records)
+        np.save(os.path.join(self.directory, LOOKUP_FILE.format(generation)), _build_lookup(battle_ids))
+        with open(os.path.join(self.directory, IDS_FILE.format(generation)), "wb") as f:
+            f.write(b"".join(battle_ids))
+
+        index_path = os.path.join(self.directory, INDEX_FILE)
+        with open(index_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "version": STORE_VERSION,
+                "codec": self.codec,
+                "dictionary": self._dictionary,
+                "count": len(self._entries),
+                "generation": generation,
+            }, f)
+        os.replace(index_path + ".tmp", index_path)
+        # readers that still have the previous generation mapped keep it until they close
+        for name in (ENTRIES_FILE, LOOKUP_FILE, IDS_FILE):
+            try:
+                os.remove(os.path.join(self.directory, name.format(self._generation)))
+            except OSError:
+                pass
+        self._generation = generation
+
+
+def train_dictionary(logs: List[str], size: int = 112640) -> Optional[bytes]:
+    # Protocol lines repeat across battles, so a shared dictionary helps even single logs.
+    # None when there are too few logs, or too little text in them, to train one
+    zstandard = _zstandard()
+    if zstandard is None:
+        raise ImportError("Training a compression dictionary needs zstandard")
+    if len(logs) < MIN_DICTIONARY_SAMPLES:
+        return None
+    try:
+        return zstandard.train_dictionary(size, [log.encode("utf-8") for log in logs]).as_bytes()
+    except zstandard.ZstdError:
+        return None
+
+
+def build_replay_store(
+    input_path: str,
+    directory: str = REPLAY_STORE_PATH,
+    dictionary_size: int = 112640,
+    dictionary_samples: int = 1000,
+    level: int = 9,
+) -> int:
+    """Copies the battles of a battle_logs parquet file or directory into a replay store.
+
+    A zstd dictionary of `dictionary_size` bytes (0 for none) is trained on the first
+    `dictionary_samples` logs when the store is new; a corpus too small to train one is
+    stored without a dictionary. Battles already in the store are
+    skipped. Returns the number of battles added.
+    """
+    from parquet_stream import iter_parquet_rows
+
+    columns = ["battle_id", "rating", "log_content"]
+    dictionary = None
+    if dictionary_size and not is_replay_store(directory) and _zstandard() is not None:
+        samples = []
+        for row in iter_parquet_rows(input_path, columns=["log_content"]):
+            samples.append(row["log_content"])
+            if len(samples) == dictionary_samples:
+                break
+        if samples:
+            dictionary = train_dictionary(samples, dictionary_size)
+
+    added = 0
+    with ReplayStoreWriter(directory, dictionary=dictionary, level=level) as writer:
+        for row in iter_parquet_rows(input_path, columns=columns):
+            if row["battle_id"] not in writer:
+                writer.add(row["battle_id"], row["rating"], row["log_content"])
+                added += 1
+    return added
+
+
+# Consumers take either a replay store or a battle_logs parquet file as their input
+def iter_battle_logs(path: str, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+    if is_replay_store(path):
+        with ReplayStore(path) as store:
+            yield from store.iter_rows(batch_size)
+    else:
+        from parquet_stream import iter_parquet_rows
+
+        yield from iter_parquet_rows(path, batch_size=batch_size)
+
+
+def battle_logs_num_rows(path: str) -> int:
+    if is_replay_store(path):
+        return _read_index(path)["count"]
+    from parquet_stream import parquet_num_rows
+
+    return parquet_num_rows(path)
+
+
+def battle_logs_schema(path: str):
+    import pyarrow as pa
+
+    if is_replay_store(path):
+        return pa.schema([("battle_id", pa.string()), ("rating", pa.int64()), ("log_content", pa.string())])
+    from parquet_stream import parquet_schema
+
+    return parquet_schema(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or read the local replay store")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Add the battles of a battle_logs parquet file to the store")
+    build.add_argument("--input", default="data/battle_logs.parquet")
+    build.add_argument("--store", default=REPLAY_STORE_PATH)
+    build.add_argument("--dictionary-size", type=int, default=112640, help="0 to compress every log on its own")
+    build.add_argument("--level", type=int, default=9)
+    get = subparsers.add_parser("get", help="Print the log of one battle")
+    get.add_argument("battle_id")
+    get.add_argument("--store", default=REPLAY_STORE_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        added = build_replay_store(args.input, args.store, dictionary_size=args.dictionary_size, level=args.level)
+        blobs_size = os.path.getsize(os.path.join(args.store, BLOBS_FILE))
+        print(f"Added {added} battles to {args.store} ({blobs_size / 1e6:.1f} MB of compressed logs)")
+    else:
+        with ReplayStore(args.store) as store:
+            print(store.get(args.battle_id))
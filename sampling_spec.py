@@ -0,0 +1,62 @@
+from typing import Any, Collection, Dict, List, NamedTuple, Optional
+import json
+import random
+
+# Parquet metadata key under which a prompts file records the spec it was generated with
+SAMPLING_METADATA_KEY = "sampling_spec"
+
+
+class SamplingSpec(NamedTuple):
+    """Which battles and which of their turns get a prompt.
+
+    A battle is kept when it is rated at least `min_rating` and has between 1 and
+    `max_turns` prompt turns (the turns before its first turn without a decision). Its
+    turns are then narrowed in this order: faint-forced switches are dropped if
+    `skip_faint_switches`, every `stride`-th remaining turn is kept, and of those each
+    is kept with probability `sample_rate`, drawn from a generator seeded with `seed` and
+    the battle id, so a battle always gets the same turns.
+    """
+
+    min_rating: int = 0
+    max_turns: Optional[int] = None
+    stride: int = 1
+    sample_rate: Optional[float] = None
+    seed: int = 0
+    skip_faint_switches: bool = False
+
+    def keeps_battle(self, rating: int, num_prompts: int) -> bool:
+        if rating < self.min_rating or num_prompts == 0:
+            return False
+        return self.max_turns is None or num_prompts <= self.max_turns
+
+    def select_turns(self, battle_id: str, num_prompts: int, forced_switches: Collection[int] = ()) -> List[int]:
+        turns = list(range(num_prompts))
+        if self.skip_faint_switches:
+            turns = [turn for turn in turns if turn not in forced_switches]
+        turns = turns[::self.stride]
+        if self.sample_rate is not None:
+            rng = random.Random(f"{self.seed}:{battle_id}")
+            turns = [turn for turn in turns if rng.random() < self.sample_rate]
+        return turns
+
+    def to_json(self) -> str:
+        return json.dumps(self._asdict())
+
+    @classmethod
+    def from_json(cls, text: str) -> "SamplingSpec":
+        return cls(**json.loads(text))
+
+
+# The filters clean_filter_prompt_parquet.py has always applied to unsampled prompts
+CLEAN_FILTER_SPEC = SamplingSpec(max_turns=50, stride=2)
+
+
+def sampling_spec_metadata(spec: SamplingSpec) -> Dict[str, str]:
+    return {SAMPLING_METADATA_KEY: spec.to_json()}
+
+
+def read_sampling_spec(schema: Any) -> Optional[SamplingSpec]:
+    # the spec a prompts file was generated with, from its pyarrow schema; None if unsampled
+    metadata = schema.metadata or {}
+    value = metadata.get(SAMPLING_METADATA_KEY.encode())
+    return SamplingSpec.from_json(value.decode()) if value is not None else None
@@ -1,45 +1,195 @@
-import pandas as pd
-from battle_simulator import BattleSimulator
-import tempfile
+from typing import Any, Deque, Dict, Iterator, List, NamedTuple, Optional, Tuple
+from collections import deque
+import argparse
+import json
+import multiprocessing
 import os
-from tqdm import tqdm
+import time
 
-# Read the parquet file
-df = pd.read_parquet('data/battle_logs.parquet')
+from battle_simulator import iter_battles
 
-# Function to run battle simulator on a single log
-def run_simulator(battle_id, log_content):
-    # Create a temporary file to store the log content
-    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_file:
-        temp_file.write(log_content)
-        temp_file_path = temp_file.name
 
+class Failure(NamedTuple):
+    error_type: str
+    # protocol command of the message the battle failed on, "" when it failed outside one
+    command: str
+    message: str
+    detail: str
+
+
+class BattleResult(NamedTuple):
+    battle_id: str
+    turns: int
+    failure: Optional[Failure]
+
+
+def _describe_failure(error: Exception) -> Failure:
+    message = getattr(error, "battle_message", None)
+    return Failure(
+        type(error).__name__,
+        message[1] if message else "",
+        "|".join(message) if message else "",
+        str(error),
+    )
+
+
+def validate_battles(battles: List[Tuple[str, str]]) -> List[BattleResult]:
+    # Simulates every (battle_id, log_content) pair to completion, in memory
+    results = []
+    for record in iter_battles(battles):
+        if not record.done:
+            continue
+        failure = None
+        if record.error is not None:
+            failure = _describe_failure(record.error)
+        elif not record.simulator.winner:
+            # the prompts are built from the winner's decisions, so a log without one is no use
+            failure = Failure("NoWinner", "win", "", "the log has no |win| message")
+        results.append(BattleResult(record.battle_id, record.turn, failure))
+    return results
+
+
+def _iter_chunks(input_path: str, chunk_size: int) -> Iterator[List[Dict[str, Any]]]:
+    from replay_store import iter_battle_logs
+
+    chunk: List[Dict[str, Any]] = []
+    for row in iter_battle_logs(input_path, batch_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class FailureReport:
+    """Failures grouped by (exception type, protocol command), plus throughput counters."""
+
+    def __init__(self, max_examples: int = 5):
+        self.max_examples = max_examples
+        self.battles = 0
+        self.passed = 0
+        self.turns = 0
+        self.groups: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._start = time.perf_counter()
+
+    def add(self, result: BattleResult) -> None:
+        self.battles += 1
+        self.turns += result.turns
+        failure = result.failure
+        if failure is None:
+            self.passed += 1
+            return
+        group = self.groups.setdefault(
+            (failure.error_type, failure.command),
+            {"error_type": failure.error_type, "command": failure.command, "count": 0, "examples": []},
+        )
+        group["count"] += 1
+        if len(group["examples"]) < self.max_examples:
+            group["examples"].append({
+                "battle_id": result.battle_id,
+                "turn": result.turns,
+                "message": failure.message,
+                "error": failure.detail,
+            })
+
+    def to_dict(self) -> Dict[str, Any]:
+        seconds = time.perf_counter() - self._start
+        return {
+            "battles": self.battles,
+            "passed": self.passed,
+            "failed": self.battles - self.passed,
+            "turns": self.turns,
+            "seconds": seconds,
+            "battles_per_second": self.battles / seconds if seconds else 0.0,
+            "turns_per_second": self.turns / seconds if seconds else 0.0,
+            "failures": sorted(self.groups.values(), key=lambda group: -group["count"]),
+        }
+
+
+def run_sanity_check(
+    input_path: str,
+    output_path: str,
+    passing_ids_path: str,
+    workers: int = 1,
+    chunk_size: int = 50,
+) -> FailureReport:
+    """Simulates every battle of `input_path` (a parquet file or replay store) to completion.
+
+    Chunks of `chunk_size` battles are spread over `workers` processes, with only a few
+    chunks per worker in flight. As chunks come back, in input order, the ids of the
+    battles that simulated cleanly are appended to `passing_ids_path` and their rows to
+    the `output_path` parquet file.
+    """
+    from parquet_stream import StreamingParquetWriter
+    from replay_store import battle_logs_num_rows, battle_logs_schema
+    from tqdm import tqdm
+
+    report = FailureReport()
+    schema = battle_logs_schema(input_path).remove_metadata()
+    progress = tqdm(total=battle_logs_num_rows(input_path), desc="Processing battles")
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
     try:
-        # Initialize and run the battle simulator
-        simulator = BattleSimulator(battle_id, temp_file_path)
-        while simulator.simulate_new_turn():
-            pass  # Simulate all turns
-        print(f"Successfully simulated battle: {battle_id}")
-        return True
-    except Exception as e:
-        print(f"Error simulating battle {battle_id}: {str(e)}")
-        return False
-    finally:
-        # Clean up the temporary file
-        os.unlink(temp_file_path)
+        with open(passing_ids_path, "w", encoding="utf-8") as passing_ids, StreamingParquetWriter(output_path, schema) as writer:
+            def collect(chunk: List[Dict[str, Any]], results: List[BattleResult]) -> None:
+                for row, result in zip(chunk, results):
+                    report.add(result)
+                    if result.failure is None:
+                        passing_ids.write(row["battle_id"] + "\n")
+                        writer.write_row(row)
+                passing_ids.flush()
+                progress.update(len(chunk))
 
-# List to store successfully processed battles
-successful_battles = []
+            in_flight: Deque[Tuple[List[Dict[str, Any]], Any]] = deque()
+            for chunk in _iter_chunks(input_path, chunk_size):
+                battles = [(row["battle_id"], row["log_content"]) for row in chunk]
+                if pool is None:
+                    collect(chunk, validate_battles(battles))
+                    continue
+                in_flight.append((chunk, pool.apply_async(validate_battles, (battles,))))
+                if len(in_flight) >= 2 * workers:
+                    chunk, result = in_flight.popleft()
+                    collect(chunk, result.get())
+            while in_flight:
+                chunk, result = in_flight.popleft()
+                collect(chunk, result.get())
+        if pool is not None:
+            pool.close()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.join()
+        progress.close()
+    return report
 
-# Iterate through all battles in the dataframe with a progress bar
-for index, row in tqdm(df.iterrows(), total=len(df), desc="Processing battles"):
-    if run_simulator(row['battle_id'], row['log_content']):
-        successful_battles.append(row)
 
-# Create a new DataFrame with only the successful battles
-successful_df = pd.DataFrame(successful_battles)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that every battle log simulates to completion")
+    # a battle_logs parquet file or a replay store directory
+    parser.add_argument("--input", default="data/battle_logs.parquet")
+    parser.add_argument("--output", default="data/processed_battle_logs.parquet")
+    parser.add_argument("--passing-ids", default="data/passing_battle_ids.txt")
+    parser.add_argument("--report", default="data/sanity_report.json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=50)
+    args = parser.parse_args()
 
-# Save the successful battles to a new parquet file
-successful_df.to_parquet('data/processed_battle_logs.parquet')
+    report = run_sanity_check(args.input, args.output, args.passing_ids, workers=args.workers, chunk_size=args.chunk_size)
+    summary = report.to_dict()
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=2)
 
-print(f"Sanity check complete. {len(successful_df)} out of {len(df)} battles have been successfully processed and saved to processed_battle_logs.parquet.")
+    print(
+        f"Sanity check complete. {summary['passed']} out of {summary['battles']} battles have been successfully "
+        f"processed and saved to {args.output}."
+    )
+    print(
+        f"{summary['battles_per_second']:.1f} battles/s, {summary['turns_per_second']:.1f} turns/s "
+        f"over {summary['seconds']:.1f} s"
+    )
+    for group in summary["failures"]:
+        print(f"{group['count']:>6}  {group['error_type']} on {group['command'] or '(no message)'}")
+    print(f"Failure report saved to {args.report}")
@@ -0,0 +1,168 @@
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Set, Tuple
+import argparse
+import hashlib
+import json
+
+# poke-env and pyarrow are only imported by the functions that need them, so
+# produce_question_prompts can import this module up front
+if TYPE_CHECKING:
+    from battle_simulator import BattleOrder, BattleSimulator
+    import pyarrow as pa
+
+# Column of a prompts file with the state hash of each prompt, in the same order as the prompts
+STATE_HASH_COLUMN = "state_hashes"
+# Parquet metadata key under which a prompts file records the dedupe mode it was generated with
+DEDUPE_METADATA_KEY = "state_dedupe"
+# exact: same teams, HP, boosts, field and choices; coarse: also near-identical states
+DEDUPE_MODES = ("exact", "coarse")
+
+
+def turn_key(simulator: "BattleSimulator", decision: Tuple["BattleOrder", bool], coarse: bool = False) -> str:
+    # The state a prompt is asked from plus the decision it is answered with: two turns with
+    # the same key make the same training example
+    text = f"{simulator.state_hash(coarse)}|{decision[0]}|{decision[1]}"
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+class StateDedupe:
+    """The turn keys already turned into a prompt, to skip turns that would repeat one.
+
+    `start_battle` begins a new battle; `add` records the key of every prompt it keeps,
+    and `hashes` holds them in prompt order. A battle that fails halfway is forgotten with
+    `discard_battle`, so its keys do not hide the states of later battles.
+    """
+
+    def __init__(self, coarse: bool = False):
+        self.coarse = coarse
+        self.seen: Set[str] = set()
+        self.hashes: List[str] = []
+
+    def key(self, simulator: "BattleSimulator", decision: Tuple["BattleOrder", bool]) -> str:
+        return turn_key(simulator, decision, self.coarse)
+
+    def start_battle(self) -> None:
+        self.hashes = []
+
+    def add(self, key: str) -> None:
+        self.seen.add(key)
+        self.hashes.append(key)
+
+    def discard_battle(self) -> None:
+        self.seen.difference_update(self.hashes)
+        self.hashes = []
+
+
+def dedupe_metadata(mode: str) -> Dict[str, str]:
+    return {DEDUPE_METADATA_KEY: mode}
+
+
+def concat_deduplicated(paths: List[str], output: str, prompts_column: str, row_group_size: int = 1000, schema: Optional["pa.Schema"] = None) -> Tuple[int, int, int]:
+    """Streams prompt shards into one file like parquet_stream.concat_parquet, dropping
+    every prompt whose state hash an earlier row already has. A battle left without prompts
+    is not written at all.
+
+    Each shard is deduplicated on its own as it is generated; this removes the duplicates
+    across shards, always keeping the first one in input order, so the output does not
+    depend on the number of workers. Without paths, `schema` is needed to write the
+    empty file. Returns the rows written, the prompts dropped and the rows dropped.
+    """
+    from parquet_stream import StreamingParquetWriter, iter_parquet_rows, parquet_schema
+
+    if schema is None:
+        if not paths:
+            raise ValueError("concat_deduplicated needs a schema when there are no files to concatenate")
+        schema = parquet_schema(paths[0])
+    seen: Set[str] = set()
+    dropped = 0
+    dropped_rows = 0
+    with StreamingParquetWriter(output, schema, row_group_size=row_group_size) as writer:
+        for path in paths:
+            for row in iter_parquet_rows(path, batch_size=row_group_size):
+                hashes = row[STATE_HASH_COLUMN]
+                kept = [i for i, key in enumerate(hashes) if key not in seen]
+                if len(kept) < len(hashes):
+                    dropped += len(hashes) - len(kept)
+                    row[prompts_column] = [row[prompts_column][i] for i in kept]
+                    row[STATE_HASH_COLUMN] = [hashes[i] for i in kept]
+                seen.update(hashes)
+                if hashes and not kept:
+                    dropped_rows += 1
+                    continue
+                writer.write_row(row)
+    return writer.rows_written, dropped, dropped_rows
+
+
+def near_duplicate_report(battles: Iterable[Tuple[str, str]], top: int = 20) -> Dict[str, Any]:
+    """How many of the corpus's prompt turns repeat an earlier one, exactly or coarsely.
+
+    Every turn with a decision is keyed both ways. The report counts the turns, the
+    distinct keys of each mode and the largest coarse clusters, with how many exact states
+    each covers and the first turn it was seen at.
+    """
+    from battle_simulator import iter_battles
+
+    turns = 0
+    exact: Set[str] = set()
+    # coarse key -> [turns, exact keys, first (battle_id, turn)]
+    clusters: Dict[str, List[Any]] = {}
+    for record in iter_battles(battles):
+        if record.done:
+            continue
+        simulator = record.simulator
+        decision = simulator.player_decision.get(record.turn - 1)
+        if decision is None or simulator.active_pokemon is None:
+            continue
+        turns += 1
+        exact_key = turn_key(simulator, decision)
+        exact.add(exact_key)
+        coarse_key = turn_key(simulator, decision, coarse=True)
+        cluster = clusters.get(coarse_key)
+        if cluster is None:
+            cluster = clusters[coarse_key] = [0, set(), (record.battle_id, record.turn - 1)]
+        cluster[0] += 1
+        cluster[1].add(exact_key)
+
+    largest = sorted(clusters.items(), key=lambda item: -item[1][0])[:top]
+    return {
+        "turns": turns,
+        "exact_distinct": len(exact),
+        "exact_duplicates": turns - len(exact),
+        "coarse_distinct": len(clusters),
+        "coarse_duplicates": turns - len(clusters),
+        "largest_coarse_clusters": [
+            {"key": key, "turns": count, "exact_states": len(exact_keys), "first_battle": first[0], "first_turn": first[1]}
+            for key, (count, exact_keys, first) in largest if count > 1
+        ],
+    }
+
+
+if __name__ == "__main__":
+    from replay_store import iter_battle_logs
+
+    parser = argparse.ArgumentParser(description="Report exact and near-duplicate turn states across battle logs")
+    # a battle_logs parquet file or a replay store directory
+    parser.add_argument("--input", default="data/battle_logs.parquet")
+    parser.add_argument("--battles", type=int, help="Only look at the first N battles")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument("--output", help="Also write the report as JSON")
+    args = parser.parse_args()
+
+    def battles():
+        for i, row in enumerate(iter_battle_logs(args.input)):
+            if i == args.battles:
+                break
+            yield row["battle_id"], row["log_content"]
+
+    report = near_duplicate_report(battles(), args.top)
+    turns = report["turns"] or 1
+    print(f"{report['turns']} prompt turns")
+    print(f"exact duplicates:  {report['exact_duplicates']} ({report['exact_duplicates'] / turns:.1%})")
+    print(f"coarse duplicates: {report['coarse_duplicates']} ({report['coarse_duplicates'] / turns:.1%})")
+    for cluster in report["largest_coarse_clusters"]:
+        print(
+            f"  {cluster['key']}: {cluster['turns']} turns, {cluster['exact_states']} exact states, "
+            f"first at {cluster['first_battle']} turn {cluster['first_turn']}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
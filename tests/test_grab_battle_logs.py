@@ -0,0 +1,103 @@
+# grab_battle_logs against a local stand-in for the replay server.
+# Run from the repository root with `python -m pytest tests`.
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+import pyarrow.parquet as pq
+import pytest
+
+from grab_battle_logs import download_logs, read_manifest, write_battle_logs
+
+
+def log_of(battle_id):
+    return f"|player|p1|Alice|\n|player|p2|Bob|\n|win|Alice|\n|c|~|{battle_id}\n"
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    # battle id -> statuses to answer with before the log is served; missing ids are a 404
+    plan = {}
+    hits = Counter()
+
+    def do_GET(self):
+        battle_id = self.path.strip("/")[: -len(".log")]
+        self.hits[battle_id] += 1
+        if battle_id not in self.plan:
+            self.send_error(404)
+            return
+        failures = self.plan[battle_id]
+        if self.hits[battle_id] <= len(failures):
+            self.send_error(failures[self.hits[battle_id] - 1])
+            return
+        body = log_of(battle_id).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    ReplayHandler.plan = {}
+    ReplayHandler.hits = Counter()
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), ReplayHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", ReplayHandler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def replays_of(ids):
+    return [{"id": battle_id, "rating": 2000 + i} for i, battle_id in enumerate(ids)]
+
+
+def manifest_ids(path):
+    with open(path, "rb") as f:
+        return [json.loads(line)["battle_id"] for line in f]
+
+
+def test_retries_with_backoff(server, tmp_path):
+    base_url, handler = server
+    handler.plan = {"gen9-1": [], "gen9-2": [503, 503], "gen9-3": [429]}
+    manifest = str(tmp_path / "manifest.jsonl")
+
+    start = time.monotonic()
+    offsets = download_logs(replays_of(["gen9-1", "gen9-2", "gen9-3", "gen9-404"]), manifest, base_url=base_url, workers=2, rate=0)
+    elapsed = time.monotonic() - start
+
+    assert sorted(offsets) == ["gen9-1", "gen9-2", "gen9-3"]
+    assert handler.hits == {"gen9-1": 1, "gen9-2": 3, "gen9-3": 2, "gen9-404": 1}
+    # the first retry is immediate, the second waits backoff_factor * 2
+    assert elapsed >= 1.0
+    assert sorted(manifest_ids(manifest)) == ["gen9-1", "gen9-2", "gen9-3"]
+
+
+def test_resume_truncates_torn_line(server, tmp_path):
+    base_url, handler = server
+    ids = ["gen9-1", "gen9-2", "gen9-3"]
+    handler.plan = {battle_id: [] for battle_id in ids}
+    manifest = tmp_path / "manifest.jsonl"
+    complete = json.dumps({"battle_id": "gen9-2", "rating": 2001, "log_content": log_of("gen9-2")}).encode() + b"\n"
+    torn = json.dumps({"battle_id": "gen9-3", "rating": 2002, "log_content": log_of("gen9-3")}).encode()[:40]
+    manifest.write_bytes(complete + torn)
+
+    assert read_manifest(str(manifest)) == {"gen9-2": 0}
+    assert manifest.read_bytes() == complete
+
+    offsets = download_logs(replays_of(ids), str(manifest), base_url=base_url, workers=2, rate=0)
+    # only the battles missing from the manifest are fetched again
+    assert handler.hits == {"gen9-1": 1, "gen9-3": 1}
+    assert manifest_ids(str(manifest))[0] == "gen9-2"
+    assert read_manifest(str(manifest)) == offsets
+
+    output = str(tmp_path / "battle_logs.parquet")
+    assert write_battle_logs(replays_of(ids), str(manifest), offsets, output) == 3
+    table = pq.read_table(output).to_pylist()
+    assert [row["battle_id"] for row in table] == ids
+    assert [row["log_content"] for row in table] == [log_of(battle_id) for battle_id in ids]
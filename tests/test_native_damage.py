@@ -0,0 +1,27 @@
+# Pinned @smogon/calc results, so the native formula cannot drift silently.
+# Run from the repository root with `python -m pytest tests`.
+from native_damage import calculate, unsupported_reason
+
+
+def test_choice_band_stab_neutral():
+    result = calculate(["Garchomp", {"item": "Choice Band"}, "Garchomp", {}, "Earthquake"])
+    assert result["damage"] == [211, 214, 217, 219, 222, 225, 226, 229, 232, 234, 237, 240, 241, 244, 247, 250]
+    assert result["originalCurHP"] == 357
+
+
+def test_super_effective():
+    result = calculate(["Garchomp", {}, "Heatran", {}, "Earthquake"])
+    assert (result["damage"][0], result["damage"][-1]) == (516, 612)
+
+
+def test_type_immunity():
+    assert calculate(["Garchomp", {}, "Corviknight", {}, "Earthquake"])["damage"] == 0
+
+
+def test_priority_immunity():
+    assert calculate(["Dragonite", {}, "Bruxish", {}, "Extreme Speed"])["damage"] == 0
+
+
+def test_variable_power_moves_go_to_the_js_calc():
+    assert unsupported_reason(["Garchomp", {}, "Heatran", {}, "Heavy Slam"]) is not None
+    assert calculate(["Garchomp", {}, "Heatran", {}, "Heavy Slam"]) is None
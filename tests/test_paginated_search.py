@@ -0,0 +1,109 @@
+# paginated_search against a local stand-in for the replay search API.
+# Run from the repository root with `python -m pytest tests`.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import threading
+
+import pytest
+
+from paginated_search import SEARCH_PATH, crawl_replays
+
+PAGE_SIZE = 3
+
+
+def replay(battle_id, rating, uploadtime):
+    return {"uploadtime": uploadtime, "id": battle_id, "format": "[Gen 9] Random Battle", "players": ["a", "b"], "rating": rating, "private": 0, "password": None}
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    replays = []
+    # (sort, page) -> replays uploaded right after that page is served, shifting the later pages
+    uploads = {}
+    # (sort, page) of every request
+    requests = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != SEARCH_PATH:
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        sort = query.get("sort", [None])[0]
+        page = int(query["page"][0])
+        self.requests.append((sort, page))
+        key = "rating" if sort == "rating" else "uploadtime"
+        ordered = sorted(self.replays, key=lambda r: -r[key])
+        body = ("]" + json.dumps(ordered[(page - 1) * PAGE_SIZE : page * PAGE_SIZE])).encode()
+        self.replays.extend(self.uploads.pop((sort, page), []))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    SearchHandler.replays = []
+    SearchHandler.uploads = {}
+    SearchHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), SearchHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", SearchHandler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def read_ids(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["id"] for line in f]
+
+
+def test_incremental_crawl(server, tmp_path):
+    base_url, handler = server
+    handler.replays = [
+        replay("r2500", 2500, 101),
+        replay("r2400", 2400, 104),
+        replay("r2300", 2300, 102),
+        replay("r2250", 2250, 100),
+        replay("r2210", 2210, 103),
+        replay("r2100", 2100, 106),
+        replay("r2000", 2000, 105),
+    ]
+    # a better replay lands while the first page is read, pushing r2300 onto the second page
+    handler.uploads = {("rating", 1): [replay("r2600", 2600, 200)]}
+    output = str(tmp_path / "replays.jsonl")
+    state = str(tmp_path / "state.json")
+
+    assert crawl_replays(output, state, base_url=base_url, min_rating=2200, workers=1, rate=0) == 5
+    first = read_ids(output)
+    assert first == ["r2500", "r2400", "r2300", "r2250", "r2210"]
+    # the third page holds a replay below the minimum rating
+    assert handler.requests == [("rating", 1), ("rating", 2), ("rating", 3)]
+    with open(state, encoding="utf-8") as f:
+        assert json.load(f) == {"max_uploadtime": 104, "min_rating": 2200}
+
+    handler.requests = []
+    handler.replays.append(replay("r2150", 2150, 201))
+    assert crawl_replays(output, state, base_url=base_url, min_rating=2200, workers=1, rate=0) == 1
+    # earlier lines are kept as they were and the new replay is appended
+    assert read_ids(output) == first + ["r2600"]
+    # newest first: the second page reaches back past the last crawl's newest upload
+    assert handler.requests == [(None, 1), (None, 2)]
+    with open(state, encoding="utf-8") as f:
+        assert json.load(f) == {"max_uploadtime": 200, "min_rating": 2200}
+
+
+def test_full_crawl_skips_known_ids(server, tmp_path):
+    base_url, handler = server
+    handler.replays = [replay(f"r{rating}", rating, rating) for rating in (2500, 2400, 2300, 2100)]
+    output = tmp_path / "replays.jsonl"
+    output.write_text(json.dumps({"rating": 2400, "id": "r2400"}) + "\n", encoding="utf-8")
+    state = str(tmp_path / "state.json")
+
+    assert crawl_replays(str(output), state, base_url=base_url, min_rating=2200, workers=2, rate=0, full=True) == 2
+    assert read_ids(str(output)) == ["r2400", "r2500", "r2300"]
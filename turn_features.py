@@ -0,0 +1,187 @@
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import argparse
+import json
+import os
+
+import numpy as np
+from poke_env.environment.pokemon_type import PokemonType
+
+from battle_simulator import BattleSimulator, iter_battles
+
+TEAM_SIZE = 6
+MAX_MOVES = 4
+BOOSTS = ("atk", "def", "spa", "spd", "spe", "accuracy", "evasion")
+# sides along the second axis of the per-pokemon columns
+PLAYER, OPPONENT = 0, 1
+
+# name -> (dtype, shape of one turn). Per-pokemon columns are (side, team slot, ...), with
+# team slots in the order the pokemon were revealed; empty slots are all zeros.
+COLUMNS: Dict[str, Tuple[Any, Tuple[int, ...]]] = {
+    "battle": (np.int32, ()),
+    "turn": (np.int16, ()),
+    # index of the player's decision in get_available_orders(), -1 when there is none
+    "decision": (np.int16, ()),
+    "decision_fainted": (np.bool_, ()),
+    "num_orders": (np.int16, ()),
+    "species": (np.int32, (2, TEAM_SIZE)),
+    "hp_fraction": (np.float32, (2, TEAM_SIZE)),
+    "status": (np.int8, (2, TEAM_SIZE)),
+    "boosts": (np.int8, (2, TEAM_SIZE, len(BOOSTS))),
+    "item": (np.int32, (2, TEAM_SIZE)),
+    "moves": (np.int32, (2, TEAM_SIZE, MAX_MOVES)),
+    "tera_type": (np.int8, (2, TEAM_SIZE)),
+    "terastallized": (np.bool_, (2, TEAM_SIZE)),
+    "active": (np.bool_, (2, TEAM_SIZE)),
+    "fainted": (np.bool_, (2, TEAM_SIZE)),
+}
+VOCAB_FILE = "vocab.json"
+
+
+class Vocabulary:
+    # Ids of species, move and item names; 0 stands for none
+    def __init__(self, names: Iterable[str] = ()):
+        self._ids: Dict[str, int] = {}
+        self.names: List[str] = [""]
+        for name in names:
+            self.id(name)
+
+    def id(self, name: Optional[str]) -> int:
+        if not name:
+            return 0
+        index = self._ids.get(name)
+        if index is None:
+            index = self._ids[name] = len(self.names)
+            self.names.append(name)
+        return index
+
+
+class TurnFeatureWriter:
+    """Fixed-width numeric features of every simulated turn, written into preallocated arrays.
+
+    Each column is one NumPy array with a row per turn. Rows are filled in place straight
+    from the simulator's pokemon, and the arrays double in size when full. `save` writes
+    every column to its own .npy file, so they can be memory-mapped for training (see
+    load_turn_features), with the id -> name tables in vocab.json.
+    """
+
+    def __init__(self, capacity: int = 4096):
+        self.rows = 0
+        self.battle_ids: List[str] = []
+        self.species = Vocabulary()
+        self.moves = Vocabulary()
+        self.items = Vocabulary()
+        self.columns: Dict[str, np.ndarray] = {
+            name: np.zeros((capacity,) + shape, dtype=dtype) for name, (dtype, shape) in COLUMNS.items()
+        }
+
+    def _grow(self) -> None:
+        for name, column in self.columns.items():
+            grown = np.zeros((2 * len(column),) + column.shape[1:], dtype=column.dtype)
+            grown[:len(column)] = column
+            self.columns[name] = grown
+
+    def add_battle(self, battle_id: str) -> int:
+        self.battle_ids.append(battle_id)
+        return len(self.battle_ids) - 1
+
+    def write_turn(self, battle: int, simulator: BattleSimulator) -> None:
+        # features of the state after simulator.turn turns, and the decision taken from it
+        if self.rows == len(self.columns["battle"]):
+            self._grow()
+        row = self.rows
+        columns = self.columns
+        columns["battle"][row] = battle
+        columns["turn"][row] = simulator.turn - 1
+        for side, team in ((PLAYER, simulator.team), (OPPONENT, simulator.opponent_team)):
+            for slot, pokemon in zip(range(TEAM_SIZE), team.values()):
+                self._write_pokemon(row, side, slot, pokemon)
+
+        columns["decision"][row] = -1
+        decision = simulator.player_decision.get(simulator.turn - 1)
+        if decision is not None and simulator.active_pokemon is not None:
+            orders = [str(order) for order in simulator.get_available_orders()]
+            columns["num_orders"][row] = len(orders)
+            chosen = str(decision[0])
+            if chosen in orders:
+                columns["decision"][row] = orders.index(chosen)
+            columns["decision_fainted"][row] = decision[1]
+        self.rows += 1
+
+    def _write_pokemon(self, row: int, side: int, slot: int, pokemon) -> None:
+        columns = self.columns
+        columns["species"][row, side, slot] = self.species.id(pokemon.species)
+        columns["hp_fraction"][row, side, slot] = pokemon.current_hp_fraction
+        if pokemon.status is not None:
+            columns["status"][row, side, slot] = pokemon.status.value
+        boosts = pokemon.boosts
+        for i, stat in enumerate(BOOSTS):
+            columns["boosts"][row, side, slot, i] = boosts.get(stat, 0)
+        columns["item"][row, side, slot] = self.items.id(pokemon.item)
+        for i, move in zip(range(MAX_MOVES), pokemon.moves):
+            columns["moves"][row, side, slot, i] = self.moves.id(move)
+        tera_type = pokemon.tera_type
+        if tera_type is not None:
+            # the player's tera types are registered from the log by name
+            if isinstance(tera_type, str):
+                tera_type = PokemonType.from_name(tera_type)
+            columns["tera_type"][row, side, slot] = tera_type.value
+        columns["terastallized"][row, side, slot] = pokemon.terastallized
+        columns["active"][row, side, slot] = pokemon.active
+        columns["fainted"][row, side, slot] = pokemon.fainted
+
+    def save(self, directory: str) -> None:
+        os.makedirs(directory, exist_ok=True)
+        for name, column in self.columns.items():
+            np.save(os.path.join(directory, f"{name}.npy"), column[:self.rows])
+        with open(os.path.join(directory, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "battles": self.battle_ids,
+                "species": self.species.names,
+                "moves": self.moves.names,
+                "items": self.items.names,
+                "boosts": list(BOOSTS),
+            }, f)
+
+
+def load_turn_features(directory: str) -> Tuple[Dict[str, np.ndarray], Dict[str, List[str]]]:
+    # Memory-mapped columns, and the vocabularies to decode them
+    columns = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in COLUMNS}
+    with open(os.path.join(directory, VOCAB_FILE), encoding="utf-8") as f:
+        return columns, json.load(f)
+
+
+def export_turn_features(battles: Iterable[Tuple[str, str]], directory: str) -> int:
+    """Simulates every (battle_id, log_content) pair and saves the features of all their turns.
+
+    Battles that fail to simulate keep the turns they got through. Returns the number of
+    turns written.
+    """
+    writer = TurnFeatureWriter()
+    battle: Optional[int] = None
+    for record in iter_battles(battles):
+        if record.done:
+            if record.error is not None:
+                print(f"Error simulating battle {record.battle_id}: {record.error}")
+            battle = None
+            continue
+        if battle is None:
+            battle = writer.add_battle(record.battle_id)
+        writer.write_turn(battle, record.simulator)
+    writer.save(directory)
+    return writer.rows
+
+
+if __name__ == "__main__":
+    from replay_store import iter_battle_logs
+
+    parser = argparse.ArgumentParser(description="Export per-turn numeric features of every battle log")
+    # a battle_logs parquet file or a replay store directory
+    parser.add_argument("--input", default="data/battle_logs.parquet")
+    parser.add_argument("--output", default="data/turn_features")
+    args = parser.parse_args()
+
+    rows = export_turn_features(
+        ((row["battle_id"], row["log_content"]) for row in iter_battle_logs(args.input)),
+        args.output,
+    )
+    print(f"Wrote the features of {rows} turns to {args.output}")